@@ -0,0 +1,82 @@
+"""Simulate adaptive mock tests against a synthetic question bank.
+
+    python benchmarks/adaptive_selection.py --bank-size 100000 --candidates 500 --length 15
+
+Reports the time to build the item tables, microseconds per select and per
+ability update, and how close the final estimates land to the simulated
+candidates' true ability, next to a fixed test of randomly chosen questions.
+server.py only needs MONGO_URL set to import; nothing connects.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np  # type: ignore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+from server import IRT_SCALE, ItemBank  # noqa: E402
+
+
+def synthetic_bank(size, rng):
+    return [
+        {"question": f"Question {i}", "options": [], "correct_answer": "", "a": a, "b": b, "c": 0.2}
+        for i, (a, b) in enumerate(zip(rng.lognormal(0.2, 0.3, size), rng.normal(0, 1.2, size)))
+    ]
+
+
+def answers_correctly(question, ability, rng):
+    a, b, c = question["a"], question["b"], question["c"]
+    return rng.random() < c + (1 - c) / (1 + np.exp(-IRT_SCALE * a * (ability - b)))
+
+
+def simulate(bank, abilities, length, adaptive, rng, timings):
+    errors = []
+    for true_ability in abilities:
+        asked, correct = [], []
+        ability = 0.0
+        for _ in range(length):
+            started = time.perf_counter()
+            if adaptive:
+                item = bank.select(ability, asked)
+            else:
+                item = int(rng.integers(len(bank)))
+            timings["select"] += time.perf_counter() - started
+            asked.append(item)
+            correct.append(answers_correctly(bank.questions[item], true_ability, rng))
+            started = time.perf_counter()
+            ability, _ = bank.estimate(asked, correct)
+            timings["estimate"] += time.perf_counter() - started
+        errors.append(ability - true_ability)
+    return float(np.sqrt(np.mean(np.square(errors))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bank-size", type=int, default=100000)
+    parser.add_argument("--candidates", type=int, default=500)
+    parser.add_argument("--length", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    questions = synthetic_bank(args.bank_size, rng)
+    started = time.perf_counter()
+    bank = ItemBank(questions)
+    print(f"tables for {args.bank_size:,} questions built in {time.perf_counter() - started:.2f}s")
+
+    abilities = rng.normal(0, 1, args.candidates)
+    steps = args.candidates * args.length
+    for adaptive in (True, False):
+        timings = {"select": 0.0, "estimate": 0.0}
+        rmse = simulate(bank, abilities, args.length, adaptive, rng, timings)
+        print(f"{'adaptive' if adaptive else 'random  '}: "
+              f"select {timings['select'] / steps * 1e6:8.1f} us/step, "
+              f"estimate {timings['estimate'] / steps * 1e6:6.1f} us/step, "
+              f"ability RMSE after {args.length} questions {rmse:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measure chat broadcast throughput for one busy room.
+
+Start the server with rate limiting off, e.g.
+
+    RATE_LIMIT_ENABLED=false BROADCAST_BATCH_MS=50 python server.py
+
+then run:
+
+    python benchmarks/broadcast.py --clients 1000 --messages 2000 --senders 10
+
+Every client joins the same room; the senders share the messages between
+them. Reports messages sent per second and messages delivered per second
+across all clients. Run once with BROADCAST_BATCH_MS=0 to compare against
+one emit per message.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import socketio  # type: ignore
+
+
+async def connect_client(url, room, counter):
+    client = socketio.AsyncClient(reconnection=False)
+
+    @client.on("new_message")
+    async def on_message(data):
+        counter["received"] += 1
+
+    @client.on("new_messages")
+    async def on_messages(data):
+        counter["received"] += len(data["messages"])
+
+    await client.connect(url, transports=["polling"])
+    await client.emit("join_room", {"company": room, "user_id": str(uuid.uuid4()), "user_name": "bench"})
+    return client
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    room = f"bench-{uuid.uuid4().hex[:8]}"
+    counter = {"received": 0}
+    clients = []
+    for start in range(0, args.clients, 100):
+        batch = min(100, args.clients - start)
+        clients += await asyncio.gather(*(connect_client(args.url, room, counter) for _ in range(batch)))
+    print(f"{len(clients)} clients joined {room}")
+
+    senders = clients[:args.senders]
+
+    async def send(sender, count):
+        user_id = str(uuid.uuid4())
+        for i in range(count):
+            await sender.emit("send_message", {"company": room, "message": f"bench {i}", "user_id": user_id, "user_name": "bench"})
+
+    started = time.perf_counter()
+    per_sender = args.messages // len(senders)
+    await asyncio.gather(*(send(sender, per_sender) for sender in senders))
+    sent_elapsed = time.perf_counter() - started
+    expected = per_sender * len(senders) * len(clients)
+
+    while counter["received"] < expected and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    print(f"sent:      {per_sender * len(senders) / sent_elapsed:,.0f} messages/s")
+    print(f"delivered: {counter['received']:,} of {expected:,} in {elapsed:.1f}s "
+          f"({counter['received'] / elapsed:,.0f} deliveries/s, "
+          f"{counter['received'] / len(clients) / elapsed:,.0f} messages/s per client)")
+
+    await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Count MongoDB round trips and latency per endpoint.
+
+Start the server with COUNT_DB_ROUND_TRIPS=true, then run:
+
+    python benchmarks/round_trips.py --base-url http://127.0.0.1:8000 --iterations 20
+
+Requests are sent one at a time so the per-process command counter in
+server.py maps exactly onto each response's X-DB-Round-Trips header.
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+import httpx  # type: ignore
+
+GOALS = {
+    "target_companies": ["Google", "Amazon"],
+    "preferred_domain": "Backend Development",
+    "expected_salary": 1500000,
+    "tech_stack": ["Python", "MongoDB"],
+}
+
+SURVEY = {
+    "dsa_skill": 5,
+    "os_knowledge": 6,
+    "dbms_skill": 7,
+    "oops_understanding": 8,
+    "networking_knowledge": 4,
+    "programming_languages": ["Python", "Java"],
+    "project_count": 3,
+    "internship_experience": False,
+    "coding_practice_hours": 2,
+}
+
+# (label, method, path, body) - measured in this order after setup
+ENDPOINTS = [
+    ("set goals", "POST", "/api/goals", GOALS),
+    ("submit survey", "POST", "/api/survey", SURVEY),
+    ("get goals", "GET", "/api/goals", None),
+    ("get survey", "GET", "/api/survey", None),
+    ("get roadmap", "GET", "/api/roadmap", None),
+    ("update roadmap item", "PUT", "/api/roadmap/progress", {"task_topic": "System Design Fundamentals", "completed": True}),
+    ("get progress", "GET", "/api/progress", None),
+    ("dashboard", "GET", "/api/dashboard", None),
+]
+
+
+def measure(http, method, path, body):
+    started = time.perf_counter()
+    response = http.request(method, path, json=body)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response.raise_for_status()
+    if "x-db-round-trips" not in response.headers:
+        raise SystemExit("No X-DB-Round-Trips header - start the server with COUNT_DB_ROUND_TRIPS=true")
+    return int(response.headers["x-db-round-trips"]), elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.base_url, timeout=60) as http:
+        email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        token = http.post("/api/auth/register", json={"email": email, "password": "bench-password", "name": "Benchmark"}).json()["access_token"]
+        http.headers["Authorization"] = f"Bearer {token}"
+
+        # Setup: the roadmap needs goals and a survey first
+        http.post("/api/goals", json=GOALS).raise_for_status()
+        http.post("/api/survey", json=SURVEY).raise_for_status()
+        trips, elapsed_ms = measure(http, "POST", "/api/roadmap/generate", None)
+
+        print(f"{'endpoint':<22}{'round trips':>12}{'p50 ms':>10}{'max ms':>10}")
+        print(f"{'generate roadmap':<22}{trips:>12}{elapsed_ms:>10.1f}{elapsed_ms:>10.1f}")
+        for label, method, path, body in ENDPOINTS:
+            results = [measure(http, method, path, body) for _ in range(args.iterations)]
+            trips = max(t for t, _ in results)
+            timings = [ms for _, ms in results]
+            print(f"{label:<22}{trips:>12}{statistics.median(timings):>10.1f}{max(timings):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
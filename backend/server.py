@@ -1,14 +1,41 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status # type: ignore
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, status # type: ignore
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials# type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
-from fastapi.responses import JSONResponse # type: ignore
+from fastapi.responses import JSONResponse, Response, StreamingResponse # type: ignore
 from fastapi.staticfiles import StaticFiles # type: ignore
 from dotenv import load_dotenv # type: ignore
 from motor.motor_asyncio import AsyncIOMotorClient # type: ignore
+from pymongo import ReturnDocument, UpdateOne, monitoring # type: ignore
+from pymongo.errors import DuplicateKeyError # type: ignore
 import os
+import asyncio
+import atexit
+import contextvars
+import csv
+import gzip
+import hmac
+import io
+import json
 import logging
+import logging.handlers
+import math
+import queue
+import random
+import sys
+import threading
+import time
 import uuid
+import weakref
+import zlib
 import bcrypt # type: ignore
+import numpy as np # type: ignore
+try:
+    import zstandard # type: ignore
+except ImportError:  # archive segments fall back to gzip
+    zstandard = None
+from cachetools import TTLCache # type: ignore
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any # type: ignore
 from pydantic import BaseModel, Field, EmailStr # type: ignore
@@ -19,17 +46,210 @@ import uvicorn # type: ignore
 # Load environment variables
 load_dotenv()
 
+# ===== LOGGING =====
+
+# Records go onto a queue and a background thread formats and writes them, so
+# logging on the event loop never blocks on stdout. Messages use %-style
+# arguments, which are only formatted on that thread and only if the record
+# passes the level and sampling filters.
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default="-")
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING from chosen loggers.
+
+    Rates come from LOG_SAMPLE_RATES, e.g. "crackit.socket=0.1,uvicorn.access=0.01",
+    and apply to the named logger and its children.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.resolved: Dict[str, float] = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self.resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self.resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Tags records with the request id and queues them unformatted.
+
+    The stock QueueHandler formats the message in the caller's thread; here
+    that's left to the writer thread, so arguments should not be mutated
+    after they're logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        return record
+
+class RequestIdMiddleware:
+    """Pure ASGI middleware giving each request an id for its log records.
+
+    Reuses an incoming X-Request-ID (e.g. from the load balancer) and echoes
+    the id back in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        request_id = ""
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+def parse_log_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for part in value.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging() -> logging.handlers.QueueListener:
+    output = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "json").lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"))
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_log_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))))
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    # uvicorn's own handlers write synchronously; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # writes out whatever is still queued
+    return listener
+
+log_listener = setup_logging()
+logger = logging.getLogger("crackit")
+socket_logger = logging.getLogger("crackit.socket")
+ai_logger = logging.getLogger("crackit.ai")
+
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL')
 if not mongo_url:
     raise ValueError("MONGO_URL environment variable is required")
 
-client = AsyncIOMotorClient(mongo_url)
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB - each one is a network round trip"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# Adds an X-DB-Round-Trips header to every response (see benchmarks/round_trips.py).
+# The count is per process, so it is only exact when requests don't overlap.
+COUNT_DB_ROUND_TRIPS = os.environ.get("COUNT_DB_ROUND_TRIPS", "false").lower() == "true"
+db_command_counter = CommandCounter()
+
+# The request being profiled, if any (see PROFILING)
+current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+
+class ProfileSpanListener(monitoring.CommandListener):
+    """Records MongoDB commands as spans of the request being profiled.
+
+    Motor runs commands on its executor threads with a copy of the request's
+    context, so `current_profile` is visible here.
+    """
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            collection = event.command.get(event.command_name)
+            name = f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name
+            profile.pending[event.request_id] = (name, time.perf_counter())
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
+
+    def _finish(self, event, ok: bool):
+        profile = current_profile.get()
+        if profile is not None:
+            started = profile.pending.pop(event.request_id, None)
+            if started:
+                profile.add_span("mongo", started[0], started[1], time.perf_counter(), ok)
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "true").lower() == "true"
+
+db_event_listeners: List[Any] = []
+if COUNT_DB_ROUND_TRIPS:
+    db_event_listeners.append(db_command_counter)
+if PROFILING_ENABLED:
+    db_event_listeners.append(ProfileSpanListener())
+
+client = AsyncIOMotorClient(mongo_url, event_listeners=db_event_listeners)
 db_name = os.environ.get('DB_NAME', 'crackit')
 db = client[db_name]
 
-print(f"MongoDB connection initialized with URL: {mongo_url[:20]}...")
-print(f"Database name: {db_name}")
+logger.info("MongoDB connection initialized with URL: %s...", mongo_url[:20])
+logger.info("Database name: %s", db_name)
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
@@ -54,14 +274,14 @@ api_router = APIRouter(prefix="/api")
 # Mount static files (for serving favicon and other static assets)
 import os
 frontend_build_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "frontend", "build"))
-print(f"Looking for frontend build at: {frontend_build_path}")
+logger.info("Looking for frontend build at: %s", frontend_build_path)
 if os.path.exists(frontend_build_path):
-    print(f"Frontend build directory found, mounting static files")
+    logger.info("Frontend build directory found, mounting static files")
     # First mount the static directory for CSS/JS files
     static_path = os.path.join(frontend_build_path, "static")
     if os.path.exists(static_path):
         main_app.mount("/static", StaticFiles(directory=static_path), name="static")
-        print("Mounted /static directory")
+        logger.info("Mounted /static directory")
     
     # Mount individual favicon files
     favicon_ico = os.path.join(frontend_build_path, "favicon.ico")
@@ -70,15 +290,15 @@ if os.path.exists(frontend_build_path):
     manifest_json = os.path.join(frontend_build_path, "manifest.json")
     
     if os.path.exists(favicon_ico):
-        print("Found favicon.ico")
+        logger.info("Found favicon.ico")
     if os.path.exists(favicon_png):
-        print("Found favicon.png")
+        logger.info("Found favicon.png")
     if os.path.exists(favicon_svg):
-        print("Found favicon.svg")
+        logger.info("Found favicon.svg")
     if os.path.exists(manifest_json):
-        print("Found manifest.json")
+        logger.info("Found manifest.json")
 else:
-    print(f"Frontend build directory not found at {frontend_build_path}")
+    logger.warning("Frontend build directory not found at %s", frontend_build_path)
 
 # CORS for main app
 main_app.add_middleware(
@@ -106,6 +326,9 @@ main_app.add_middleware(
     expose_headers=["*"]
 )
 
+# Request ids for log records (see LOGGING)
+main_app.add_middleware(RequestIdMiddleware)
+
 # Create socket app that combines FastAPI with SocketIO
 # IMPORTANT: All routes must be defined on main_app BEFORE this line
 socket_app = socketio.ASGIApp(sio, main_app, socketio_path='socket.io')
@@ -148,6 +371,7 @@ class Goal(BaseModel):
     expected_salary: int = 0
     tech_stack: List[str] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class SurveyResponse(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -171,6 +395,7 @@ class RoadmapItem(BaseModel):
     resources: List[str] = []
     completed: bool = False
     completed_at: Optional[datetime] = None
+    focus: str = ""  # what the topic addresses, e.g. skill:dsa_skill, company:Google, domain, tech:React, core
 
 class Roadmap(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -179,6 +404,8 @@ class Roadmap(BaseModel):
     domain: str
     roadmap_items: List[RoadmapItem] = []
     overall_progress: float = 0.0
+    profile_snapshot: Dict[str, Any] = {}  # goal/survey inputs the roadmap was built from
+    source: str = "ai"  # ai, fallback or reused (adapted from a similar user's roadmap)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -189,6 +416,7 @@ class TestQuestion(BaseModel):
     correct_answer: str
     user_answer: str = ""
     time_taken: int = 0  # seconds
+    topic: str = ""
 
 class MockTest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -201,8 +429,26 @@ class MockTest(BaseModel):
     time_spent: int = 0  # seconds
     weak_areas: List[str] = []
     feedback: str = ""
+    adaptive: bool = False
+    ability: Optional[float] = None  # IRT ability estimate, adaptive tests only
     completed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# What the client sees of a started test: no answer key
+class PublicTestQuestion(BaseModel):
+    question_id: str
+    question: str
+    options: List[str] = []
+
+class MockTestSession(BaseModel):
+    id: str
+    user_id: str
+    test_type: str
+    questions: List[PublicTestQuestion] = []
+    total_questions: int = 0  # the most an adaptive test will ask
+    adaptive: bool = False
+    started_at: datetime
+    expires_at: datetime
+
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -248,6 +494,472 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Admin-only endpoints (exports, diagnostics) require this key in X-Admin-Key
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY", "")
+
+def is_admin_request(request: Request) -> bool:
+    supplied = request.headers.get("x-admin-key", "")
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(supplied, ADMIN_API_KEY)
+
+async def require_admin(request: Request):
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if not is_admin_request(request):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+
+# ===== BACKGROUND WORK =====
+
+# Work that outlives the request that started it. The lifespan shutdown waits
+# for these tasks and runs the flush hooks before the process exits.
+background_tasks: set = set()
+shutdown_hooks: List[Any] = []
+
+def spawn_background(coro, name: Optional[str] = None) -> "asyncio.Task":
+    """Run `coro` without blocking the caller; shutdown drains it before exit"""
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def on_shutdown(hook):
+    """Register an async callable that flushes buffered writes on shutdown"""
+    shutdown_hooks.append(hook)
+    return hook
+
+async def drain_background_work(timeout: float):
+    if background_tasks:
+        logger.info("Waiting for %d background task(s) to finish", len(background_tasks))
+        done, pending = await asyncio.wait(set(background_tasks), timeout=timeout)
+        for task in pending:
+            logger.warning("Cancelling background task %s after %ss", task.get_name(), timeout)
+            task.cancel()
+    for hook in shutdown_hooks:
+        try:
+            await asyncio.wait_for(hook(), timeout=timeout)
+        except Exception as e:
+            logger.error("Shutdown hook %s failed: %s", getattr(hook, '__name__', hook), e)
+
+# ===== PROFILING =====
+
+# A request is stack-sampled when it sends X-Profile with a valid X-Admin-Key,
+# or at random with PROFILE_SAMPLE_RATE. With PROFILE_SLOW_MS set, every
+# request also records its MongoDB and Gemini spans and is kept if it takes
+# longer than that. Kept profiles are listed under /api/admin/profiles.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_DEPTH = 64
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason  # requested, sampled or slow
+        self.status = 0
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[tuple] = []
+        self.pending: Dict[int, tuple] = {}  # MongoDB request id -> (name, start)
+        self.samples: Dict[str, int] = {}  # folded stack -> count
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread_id = 0
+
+    def add_span(self, kind: str, name: str, start: float, end: float, ok: bool = True):
+        if not self.duration:  # ignore background work that outlives the request
+            self.spans.append((kind, name, start - self.started, end - start, ok))
+
+    def summary(self) -> dict:
+        span_ms: Dict[str, float] = {}
+        for kind, _, _, duration, _ in self.spans:
+            span_ms[kind] = span_ms.get(kind, 0) + duration * 1000
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "span_count": len(self.spans),
+            "span_ms": {kind: round(ms, 2) for kind, ms in span_ms.items()},
+            "sample_count": sum(self.samples.values()),
+        }
+
+    def to_dict(self) -> dict:
+        total = sum(self.samples.values())
+        return {
+            **self.summary(),
+            "spans": [
+                {"kind": kind, "name": name, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2), "ok": ok}
+                for kind, name, start, duration, ok in self.spans
+            ],
+            "stacks": [
+                {"stack": stack, "samples": count, "share": round(count / total, 4)}
+                for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])
+            ],
+        }
+
+    def folded(self) -> str:
+        """Samples in collapsed-stack format, for flamegraph.pl or speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+@contextmanager
+def profile_span(kind: str, name: str):
+    """Time a block as a span of the request being profiled, if there is one"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        profile.add_span(kind, name, start, time.perf_counter(), ok)
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Background thread sampling the event loop's stack for profiled requests.
+
+    Only runs while at least one request is being sampled. A sample is
+    attributed to the request's frames when its task is the one running;
+    otherwise it's counted as the loop waiting on I/O or running other tasks,
+    which is where awaited MongoDB and Gemini time shows up.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: set = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile):
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def remove(self, profile: RequestProfile):
+        with self.lock:
+            self.active.discard(profile)
+
+    def run(self):
+        while True:
+            if not self.active:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            time.sleep(self.interval)
+            with self.lock:
+                profiles = list(self.active)
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is None:
+                    continue
+                running = asyncio.current_task(profile.loop)
+                if running is None:
+                    stack = "[event loop waiting on I/O]"
+                elif running is not profile.task:
+                    stack = "[other tasks]"
+                else:
+                    stack = fold_stack(frame)
+                profile.samples[stack] = profile.samples.get(stack, 0) + 1
+
+stack_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+profile_store: deque = deque(maxlen=int(os.environ.get("PROFILE_STORE_SIZE", "50")))
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: a pass-through unless the request is profiled"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        reason = None
+        if ADMIN_API_KEY:
+            request = Request(scope)
+            if request.headers.get("x-profile") and is_admin_request(request):
+                reason = "requested"
+        if reason is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+        if reason is None and not PROFILE_SLOW_MS:
+            return await self.app(scope, receive, send)
+        
+        profile = RequestProfile(scope["method"], scope["path"], reason or "slow")
+        token = current_profile.set(profile)
+        if reason:
+            profile.task = asyncio.current_task()
+            profile.loop = asyncio.get_running_loop()
+            profile.thread_id = threading.get_ident()
+            stack_sampler.add(profile)
+        
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if reason:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            current_profile.reset(token)
+            if reason:
+                stack_sampler.remove(profile)
+            profile.duration = time.perf_counter() - profile.started
+            if reason or profile.duration * 1000 >= PROFILE_SLOW_MS:
+                profile_store.append(profile)
+
+if PROFILING_ENABLED:
+    main_app.add_middleware(ProfilingMiddleware)
+
+# ===== PER-USER DOCUMENTS =====
+
+# Collections holding exactly one document per user
+USER_SINGLETON_COLLECTIONS = ("goals", "surveys", "progress", "roadmaps")
+
+async def upsert_user_document(collection, user_id: str, fields: dict, on_insert: Optional[dict] = None) -> dict:
+    """Create or update the user's document in `collection` in one round trip.
+
+    `fields` are written every time; `on_insert` and a fresh `id` only when
+    the document is created, so ids stay stable. Returns the stored document.
+    """
+    fields = {k: v for k, v in fields.items() if k not in ("_id", "user_id")}
+    insert_only = {k: v for k, v in {"id": str(uuid.uuid4()), **(on_insert or {})}.items() if k not in fields}
+    
+    update = {"$set": fields}
+    if insert_only:
+        update["$setOnInsert"] = insert_only
+    
+    return await collection.find_one_and_update(
+        {"user_id": user_id},
+        update,
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def ensure_user_document_indexes():
+    # The unique index is what makes concurrent first writes safe
+    for name in USER_SINGLETON_COLLECTIONS:
+        try:
+            await db[name].create_index("user_id", unique=True)
+        except Exception as e:
+            logger.warning("Could not create unique user_id index on %s (duplicate documents?): %s", name, e)
+
+# ===== RATE LIMITING =====
+
+# Token buckets per route/event, written as "<burst>/<seconds to refill>".
+# Override any entry with RATE_LIMIT_<NAME>, e.g. RATE_LIMIT_AUTH_LOGIN=20/60
+DEFAULT_RATE_LIMITS = {
+    "auth_login": "10/60",          # per IP - bcrypt is CPU bound
+    "roadmap_generate": "5/3600",   # per user - full Gemini call
+    "roadmap_refresh": "20/3600",   # per user - small Gemini call
+    "test_submit": "20/600",        # per user - Gemini feedback
+    "send_message": "20/10",        # per user (REST) or IP (Socket.IO)
+}
+
+def parse_rate_limit(value: str) -> tuple:
+    """Turn "<burst>/<seconds>" into (capacity, tokens refilled per second)"""
+    burst, seconds = value.split("/")
+    capacity = float(burst)
+    return capacity, capacity / float(seconds)
+
+def load_rate_limits() -> Dict[str, tuple]:
+    limits = {}
+    for name, default in DEFAULT_RATE_LIMITS.items():
+        value = os.environ.get(f"RATE_LIMIT_{name.upper()}", default)
+        try:
+            limits[name] = parse_rate_limit(value)
+        except ValueError:
+            logger.error("Invalid rate limit %r for %s, using %s", value, name, default)
+            limits[name] = parse_rate_limit(default)
+    return limits
+
+class InMemoryRateLimitBackend:
+    """Token buckets kept in this process.
+
+    Each key holds [tokens, updated_at, full_at] and nothing else. The dict is
+    kept in least-recently-used order so idle buckets sit at the front and can
+    be dropped in O(1); a bucket that has refilled completely is identical to a
+    missing one, so evicting it never changes a decision. Buckets that are
+    still refilling are never dropped, so `max_keys` is a soft limit: past it,
+    refilled buckets anywhere in the dict are swept out at most once a second.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._next_sweep = 0.0
+
+    async def setup(self):
+        pass
+
+    async def consume(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens from the bucket. Returns 0 when allowed, otherwise seconds until it would be."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            self._buckets.move_to_end(key)
+
+        retry_after = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / refill_rate
+
+        full_at = now + (capacity - tokens) / refill_rate
+        if bucket is None:
+            self._buckets[key] = [tokens, now, full_at]
+        else:
+            bucket[0], bucket[1], bucket[2] = tokens, now, full_at
+
+        self._evict(now)
+        return retry_after
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if oldest[2] > now:
+                break
+            buckets.popitem(last=False)
+        if len(buckets) > self.max_keys and now >= self._next_sweep:
+            self._next_sweep = now + 1.0
+            for key in [key for key, bucket in buckets.items() if bucket[2] <= now]:
+                del buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class MongoRateLimitBackend:
+    """Token buckets shared by every worker through a MongoDB collection.
+
+    The refill and the take happen in one pipeline update, so concurrent
+    workers never race on a bucket. Idle buckets are removed by a TTL index.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def consume(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        now = time.time()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}, refill_rate]},
+        ]}]}
+        allowed = {"$gte": ["$tokens", cost]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {
+                    "tokens": {"$cond": [allowed, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "retry_after": {"$cond": [allowed, 0, {"$divide": [{"$subtract": [cost, "$tokens"]}, refill_rate]}]},
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_rate),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return float(bucket.get("retry_after", 0))
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, tuple], backend, enabled: bool = True):
+        self.limits = limits
+        self.backend = backend
+        self.enabled = enabled
+
+    async def hit(self, name: str, identity: str) -> float:
+        """Record one call of `name` by `identity`. Returns 0 when allowed, otherwise the Retry-After in seconds."""
+        if not self.enabled or name not in self.limits:
+            return 0.0
+        capacity, refill_rate = self.limits[name]
+        try:
+            return await self.backend.consume(f"{name}:{identity}", capacity, refill_rate)
+        except Exception as e:
+            # Never take the API down because the limiter store is unavailable
+            logger.error("Rate limiter error for %s: %s", name, e)
+            return 0.0
+
+def create_rate_limiter() -> RateLimiter:
+    backend_name = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend_name == "mongo":
+        backend = MongoRateLimitBackend(db.rate_limits)
+    else:
+        backend = InMemoryRateLimitBackend(int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000")))
+    enabled = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    return RateLimiter(load_rate_limits(), backend, enabled=enabled)
+
+rate_limiter = create_rate_limiter()
+
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "true").lower() == "true"
+# Proxies in front of the app that append to X-Forwarded-For (Render has one)
+TRUSTED_PROXY_HOPS = max(1, int(os.environ.get("TRUSTED_PROXY_HOPS", "1")))
+
+def forwarded_client_ip(forwarded: str) -> str:
+    """The address our own proxies saw, from an X-Forwarded-For header.
+
+    Each proxy appends the address it received the request from, so only the
+    last TRUSTED_PROXY_HOPS entries can be trusted; anything to their left was
+    sent by the client and can be made up.
+    """
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    if not hops:
+        return ""
+    return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+
+def get_client_ip(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        ip = forwarded_client_ip(request.headers.get("x-forwarded-for", ""))
+        if ip:
+            return ip
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(name: str, identity: str):
+    retry_after = await rate_limiter.hit(name, identity)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def rate_limit_by_ip(name: str):
+    async def dependency(request: Request):
+        await enforce_rate_limit(name, get_client_ip(request))
+    return dependency
+
+def rate_limit_by_user(name: str):
+    # get_current_user is cached per request, so this adds no extra user lookup
+    async def dependency(current_user: User = Depends(get_current_user)):
+        await enforce_rate_limit(name, current_user.id)
+    return dependency
+
 # ===== AI SERVICE =====
 
 import google.generativeai as genai # type: ignore
@@ -263,11 +975,12 @@ async def get_ai_response(prompt: str, system_message: str = "You are a helpful
         full_prompt = f"{system_message}\n\n{prompt}"
         
         
-        response = await model.generate_content_async(full_prompt)
-        print(response)
+        with profile_span("gemini", "generate_content"):
+            response = await model.generate_content_async(full_prompt)
+        ai_logger.debug("Gemini response: %s", response)
         return response.text
     except Exception as e:
-        logging.error(f"AI service error: {e}")
+        ai_logger.error("AI service error: %s", e)
         return "I'm sorry, I'm having trouble processing your request right now. Please try again later."
 
 
@@ -285,10 +998,1331 @@ TECH_DOMAINS = [
     "Cloud Computing", "Cybersecurity", "Game Development", "UI/UX Design"
 ]
 
-PROGRAMMING_LANGUAGES = [
-    "Python", "JavaScript", "Java", "C++", "C#", "Go", "Rust", "TypeScript",
-    "Swift", "Kotlin", "PHP", "Ruby", "Scala", "R", "MATLAB"
-]
+PROGRAMMING_LANGUAGES = [
+    "Python", "JavaScript", "Java", "C++", "C#", "Go", "Rust", "TypeScript",
+    "Swift", "Kotlin", "PHP", "Ruby", "Scala", "R", "MATLAB"
+]
+
+# ===== ROADMAP BUILDING =====
+
+WEAK_SKILL_THRESHOLD = 7  # skills rated below this get dedicated topics
+
+SKILL_FIELDS = {
+    "dsa_skill": "Data Structures & Algorithms",
+    "os_knowledge": "Operating Systems",
+    "dbms_skill": "Database Management",
+    "oops_understanding": "Object-Oriented Programming",
+    "networking_knowledge": "Computer Networks",
+}
+
+# Used to tag topics from older roadmaps that were stored without a focus
+SKILL_KEYWORDS = {
+    "dsa_skill": ["dsa", "algorithm", "data structure", "array", "string", "dynamic programming", "graph", "tree", "sorting", "recursion"],
+    "os_knowledge": ["operating system", "process", "thread", "memory management", "scheduling", "concurrency"],
+    "dbms_skill": ["database", "dbms", "sql", "query", "normalization", "indexing"],
+    "oops_understanding": ["object-oriented", "oop", "design pattern", "solid"],
+    "networking_knowledge": ["network", "tcp", "http", "dns", "protocol"],
+}
+
+ROADMAP_SYSTEM_MESSAGE = "You are an expert career coach specializing in tech placements. Create personalized roadmaps that address individual weaknesses and company-specific requirements."
+
+def roadmap_profile_snapshot(goal: Goal, survey: SurveyResponse) -> Dict[str, Any]:
+    """The inputs a roadmap depends on, stored with it so later changes can be diffed"""
+    return {
+        "target_companies": list(goal.target_companies),
+        "preferred_domain": goal.preferred_domain,
+        "tech_stack": list(goal.tech_stack),
+        "skills": {field: getattr(survey, field) for field in SKILL_FIELDS},
+        "programming_languages": list(survey.programming_languages),
+        "coding_practice_hours": survey.coding_practice_hours,
+    }
+
+def valid_focuses(snapshot: Dict[str, Any]) -> List[str]:
+    focuses = [f"skill:{field}" for field in SKILL_FIELDS]
+    focuses += [f"company:{company}" for company in snapshot.get("target_companies", [])]
+    focuses += [f"tech:{tech}" for tech in snapshot.get("tech_stack", [])]
+    return focuses + ["domain", "core"]
+
+def infer_item_focus(item: RoadmapItem, snapshot: Dict[str, Any]) -> str:
+    if item.focus:
+        return item.focus
+    text = f"{item.topic} {item.description}".lower()
+    for company in snapshot.get("target_companies", []):
+        if company.lower() in text:
+            return f"company:{company}"
+    for tech in snapshot.get("tech_stack", []):
+        if tech.lower() in text:
+            return f"tech:{tech}"
+    for field, keywords in SKILL_KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            return f"skill:{field}"
+    domain = snapshot.get("preferred_domain", "")
+    if domain and domain.split()[0].lower() in text:
+        return "domain"
+    return "core"
+
+def parse_roadmap_items(ai_response: str, limit: int, snapshot: Dict[str, Any]) -> List[RoadmapItem]:
+    """Pull the JSON array of topics out of a Gemini response"""
+    import json
+    import re
+    
+    roadmap_items = []
+    allowed_focuses = set(valid_focuses(snapshot))
+    try:
+        # First try to extract JSON array from response
+        start_idx = ai_response.find('[')
+        end_idx = ai_response.rfind(']') + 1
+        
+        if start_idx != -1 and end_idx != -1:
+            json_str = ai_response[start_idx:end_idx]
+            # Clean up any potential formatting issues
+            json_str = re.sub(r'\n\s*', ' ', json_str)  # Remove newlines
+            json_str = re.sub(r'}\s*{', '},{', json_str)  # Fix missing commas
+            
+            items_data = json.loads(json_str)
+            
+            for item in items_data[:limit]:
+                # Ensure all required fields are present with defaults
+                roadmap_item = RoadmapItem(
+                    topic=item.get('topic', 'Learning Topic'),
+                    description=item.get('description', 'Important skill to master'),
+                    priority=item.get('priority', 'Medium'),
+                    estimated_hours=int(item.get('estimated_hours', 20)),
+                    resources=item.get('resources', ['Practice and study materials'])
+                )
+                focus = item.get('focus', '')
+                roadmap_item.focus = focus if focus in allowed_focuses else infer_item_focus(roadmap_item, snapshot)
+                roadmap_items.append(roadmap_item)
+                
+    except Exception as e:
+        ai_logger.warning("Failed to parse AI response: %s", e)
+    
+    return roadmap_items
+
+def default_roadmap_items(goal: Goal, survey: SurveyResponse) -> List[RoadmapItem]:
+    """Personalized topics used when the AI response can't be parsed"""
+    # Get user's weak areas (skills below 7)
+    weak_skills = []
+    if survey.dsa_skill < WEAK_SKILL_THRESHOLD:
+        weak_skills.extend(['DSA', 'Algorithms', 'Data Structures'])
+    if survey.os_knowledge < WEAK_SKILL_THRESHOLD:
+        weak_skills.append('Operating Systems')
+    if survey.dbms_skill < WEAK_SKILL_THRESHOLD:
+        weak_skills.append('Database Management')
+    if survey.oops_understanding < WEAK_SKILL_THRESHOLD:
+        weak_skills.append('Object-Oriented Programming')
+    if survey.networking_knowledge < WEAK_SKILL_THRESHOLD:
+        weak_skills.append('Computer Networks')
+    
+    # Domain-specific roadmaps
+    if 'Frontend' in goal.preferred_domain or 'Frontend Development' in goal.preferred_domain:
+        domain_items = [
+            RoadmapItem(topic="React.js Advanced Concepts", description="Master hooks, context, and state management for modern React applications", priority="High", estimated_hours=35, resources=["React Official Documentation", "Frontend Masters React Course", "React TypeScript Cheatsheet"], focus="domain"),
+            RoadmapItem(topic="JavaScript ES6+ Features", description="Deep dive into modern JavaScript features and async programming", priority="High", estimated_hours=25, resources=["MDN JavaScript Guide", "JavaScript.info", "ES6 Features Guide"], focus="domain"),
+            RoadmapItem(topic="CSS Grid & Flexbox Mastery", description="Master modern CSS layout techniques for responsive design", priority="High", estimated_hours=20, resources=["CSS Grid Guide", "Flexbox Froggy", "CSS-Tricks Flexbox Guide"], focus="domain"),
+            RoadmapItem(topic="Frontend Performance Optimization", description="Learn techniques to optimize web application performance", priority="Medium", estimated_hours=30, resources=["Web.dev Performance", "Chrome DevTools Guide", "Frontend Performance Checklist"], focus="domain")
+        ]
+    elif 'Backend' in goal.preferred_domain or 'Full Stack' in goal.preferred_domain:
+        domain_items = [
+            RoadmapItem(topic="REST API Design Principles", description="Master RESTful API design and best practices", priority="High", estimated_hours=25, resources=["REST API Tutorial", "API Design Best Practices", "Postman API Testing"], focus="domain"),
+            RoadmapItem(topic="Database Optimization", description="Learn query optimization and database performance tuning", priority="High", estimated_hours=35, resources=["SQL Performance Tuning", "Database Indexing Guide", "Query Optimization Techniques"], focus="domain"),
+            RoadmapItem(topic="Microservices Architecture", description="Understand distributed systems and microservices patterns", priority="Medium", estimated_hours=40, resources=["Microservices Patterns", "System Design Primer", "Docker & Kubernetes Basics"], focus="domain")
+        ]
+    elif 'Data Science' in goal.preferred_domain or 'Machine Learning' in goal.preferred_domain:
+        domain_items = [
+            RoadmapItem(topic="Statistics and Probability", description="Master statistical concepts essential for data analysis", priority="High", estimated_hours=30, resources=["Khan Academy Statistics", "Think Stats", "Statistical Learning with R"], focus="domain"),
+            RoadmapItem(topic="Machine Learning Algorithms", description="Understand supervised and unsupervised learning algorithms", priority="High", estimated_hours=45, resources=["Scikit-learn Documentation", "Andrew Ng ML Course", "Hands-on ML Book"], focus="domain"),
+            RoadmapItem(topic="Data Visualization", description="Learn to create meaningful visualizations and dashboards", priority="Medium", estimated_hours=25, resources=["Matplotlib/Seaborn Tutorials", "Tableau Basics", "D3.js for Web Viz"], focus="domain")
+        ]
+    else:
+        domain_items = []
+    
+    # Skill-based items (focus on weak areas)
+    skill_items = []
+    if 'DSA' in weak_skills:
+        skill_items.extend([
+            RoadmapItem(topic="Array and String Manipulation", description="Master fundamental array and string algorithms", priority="High", estimated_hours=25, resources=["LeetCode Array Problems", "GeeksforGeeks Arrays", "Striver's A2Z DSA Sheet"], focus="skill:dsa_skill"),
+            RoadmapItem(topic="Dynamic Programming Mastery", description="Solve complex optimization problems using DP", priority="High", estimated_hours=35, resources=["DP Playlist by Aditya Verma", "LeetCode DP Problems", "CSES Problem Set"], focus="skill:dsa_skill")
+        ])
+    
+    if 'Operating Systems' in weak_skills:
+        skill_items.append(
+            RoadmapItem(topic="Process Management & Threading", description="Understand process scheduling and synchronization", priority="Medium", estimated_hours=20, resources=["Operating System Concepts", "GeeksforGeeks OS", "YouTube OS Tutorials"], focus="skill:os_knowledge")
+        )
+    
+    # Core technical items
+    core_items = [
+        RoadmapItem(topic="System Design Fundamentals", description="Learn scalability patterns and distributed system concepts", priority="High", estimated_hours=30, resources=["System Design Primer", "Designing Data Intensive Applications", "High Scalability Blog"], focus="core"),
+        RoadmapItem(topic="Git and Version Control", description="Master collaborative development with Git workflows", priority="Medium", estimated_hours=15, resources=["Git Documentation", "Atlassian Git Tutorials", "GitHub Workflow Guide"], focus="core"),
+        RoadmapItem(topic="Testing and Debugging", description="Learn unit testing and debugging methodologies", priority="Medium", estimated_hours=25, resources=["Testing Best Practices", f"{survey.programming_languages[0] if survey.programming_languages else 'Python'} Testing Framework", "Debugging Techniques"], focus="core"),
+        RoadmapItem(topic="Code Review and Best Practices", description="Understand clean code principles and review processes", priority="Medium", estimated_hours=20, resources=["Clean Code Book", "Code Review Best Practices", "Refactoring Techniques"], focus="core")
+    ]
+    
+    # Company-specific items
+    company_items = []
+    if 'Google' in goal.target_companies or 'Microsoft' in goal.target_companies:
+        faang_company = 'Google' if 'Google' in goal.target_companies else 'Microsoft'
+        company_items.append(
+            RoadmapItem(topic="Advanced Algorithm Optimization", description="Master complex algorithms for FAANG interviews", priority="High", estimated_hours=40, resources=["Elements of Programming Interviews", "Cracking the Coding Interview", "LeetCode Hard Problems"], focus=f"company:{faang_company}")
+        )
+    
+    return domain_items + skill_items + core_items + company_items
+
+async def build_roadmap_items(goal: Goal, survey: SurveyResponse, snapshot: Dict[str, Any]) -> tuple:
+    """Ask Gemini for a full roadmap. Returns (items, source)."""
+    # Generate AI roadmap
+    prompt = f"""
+    Generate a highly personalized placement preparation roadmap based on this SPECIFIC user profile:
+
+    USER PROFILE:
+    - Target Companies: {', '.join(goal.target_companies)}
+    - Domain: {goal.preferred_domain}
+    - Expected Salary: ₹{goal.expected_salary}
+    - Tech Stack: {', '.join(goal.tech_stack)}
+    
+    CURRENT SKILL LEVELS (1-10 scale):
+    - DSA: {survey.dsa_skill}/10
+    - Operating Systems: {survey.os_knowledge}/10 
+    - Database Management: {survey.dbms_skill}/10
+    - Object-Oriented Programming: {survey.oops_understanding}/10
+    - Computer Networks: {survey.networking_knowledge}/10
+    
+    EXPERIENCE PROFILE:
+    - Programming Languages: {', '.join(survey.programming_languages)}
+    - Projects Completed: {survey.project_count}
+    - Internship Experience: {'Yes' if survey.internship_experience else 'No'}
+    - Daily Practice Hours: {survey.coding_practice_hours}
+    
+    INSTRUCTIONS:
+    Create a UNIQUE roadmap with 15-20 learning topics that:
+    1. Focuses heavily on {goal.preferred_domain} specific skills
+    2. Prioritizes weak areas (skills rated below {WEAK_SKILL_THRESHOLD}/10)
+    3. Matches {', '.join(goal.target_companies)} company requirements
+    4. Considers the user's current experience level
+    5. Includes domain-specific technologies from their tech stack: {', '.join(goal.tech_stack)}
+    
+    Each topic should have:
+    - topic: Clear, specific topic name
+    - description: 1-2 sentences explaining why it's important for this user
+    - priority: High/Medium/Low based on user's weak areas and target companies
+    - estimated_hours: Realistic hours needed based on current skill level
+    - resources: 2-3 specific resources (prefer user's programming languages when possible)
+    - focus: the one thing this topic addresses, exactly one of: {', '.join(valid_focuses(snapshot))}
+    
+    Return ONLY a JSON array of objects with the above keys.
+    """
+    
+    ai_response = await get_ai_response(prompt, ROADMAP_SYSTEM_MESSAGE)
+    
+    # Parse AI response and create roadmap items (limit to 20 items)
+    roadmap_items = parse_roadmap_items(ai_response, 20, snapshot)
+    
+    if roadmap_items:
+        return roadmap_items, "ai"
+    
+    # If parsing failed or returned no items, use enhanced personalized default items
+    all_items = default_roadmap_items(goal, survey)
+    
+    # Select top 15 items, prioritizing High priority items
+    high_priority = [item for item in all_items if item.priority == "High"]
+    medium_priority = [item for item in all_items if item.priority == "Medium"]
+    
+    return (high_priority + medium_priority)[:15], "fallback"
+
+def diff_roadmap_inputs(old: Dict[str, Any], new: Dict[str, Any]) -> tuple:
+    """Work out which focuses went stale and which now need topics.
+
+    Returns (stale, needed): topics tagged with a stale focus no longer fit the
+    profile, and each needed focus should get fresh topics.
+    """
+    stale, needed = set(), []
+    
+    old_skills, new_skills = old.get("skills", {}), new.get("skills", {})
+    for field in SKILL_FIELDS:
+        was_weak = old_skills.get(field, 10) < WEAK_SKILL_THRESHOLD
+        is_weak = new_skills.get(field, 10) < WEAK_SKILL_THRESHOLD
+        if was_weak and not is_weak:
+            stale.add(f"skill:{field}")
+        elif is_weak and not was_weak:
+            needed.append(f"skill:{field}")
+    
+    for key, prefix in (("target_companies", "company"), ("tech_stack", "tech")):
+        old_values, new_values = set(old.get(key, [])), set(new.get(key, []))
+        stale.update(f"{prefix}:{value}" for value in old_values - new_values)
+        needed.extend(f"{prefix}:{value}" for value in new.get(key, []) if value not in old_values)
+    
+    if old.get("preferred_domain") != new.get("preferred_domain"):
+        stale.add("domain")
+        needed.append("domain")
+    
+    return stale, needed
+
+def describe_focus(focus: str, goal: Goal) -> str:
+    kind, _, value = focus.partition(":")
+    if kind == "skill":
+        return f"{SKILL_FIELDS[value]} (a weak area for this user)"
+    if kind == "company":
+        return f"{value} interview preparation"
+    if kind == "tech":
+        return f"{value} from the user's tech stack"
+    if kind == "domain":
+        return f"{goal.preferred_domain} domain skills"
+    return "general placement preparation"
+
+def calculate_roadmap_progress(roadmap_items: List[RoadmapItem]) -> float:
+    total_items = len(roadmap_items)
+    completed_items = sum(1 for item in roadmap_items if item.completed)
+    return (completed_items / total_items * 100) if total_items > 0 else 0.0
+
+async def load_goal_and_survey(user_id: str) -> tuple:
+    goal_dict, survey_dict = await asyncio.gather(
+        db.goals.find_one({"user_id": user_id}),
+        db.surveys.find_one({"user_id": user_id})
+    )
+    
+    if not goal_dict or not survey_dict:
+        raise HTTPException(status_code=400, detail="Please complete your goals and skill survey first")
+    
+    return Goal(**goal_dict), SurveyResponse(**survey_dict)
+
+# ===== LEADERBOARD & COHORTS =====
+
+# Materialized views kept up to date as tests are submitted and roadmap items
+# completed, so leaderboard and cohort reads never scan the source collections.
+#   readiness_board: one entry per user with their readiness and cohorts
+#   cohort_stats:    per cohort ("all", "company:<name>", "college:<name>")
+#                    member count, readiness histogram and per test type scores
+READINESS_BUCKETS = 10  # histogram buckets of 10 percentage points
+
+def readiness_bucket(value: float) -> str:
+    return str(min(int(value // (100 / READINESS_BUCKETS)), READINESS_BUCKETS - 1))
+
+def compute_readiness(roadmap_progress: float, test_count: int, score_sum: float) -> float:
+    # Same weighting as calculate_progress: half roadmap, half average test score
+    readiness = roadmap_progress * 0.5
+    if test_count:
+        readiness += score_sum / test_count * 0.5
+    return min(readiness, 100)
+
+def cohort_keys(companies: List[str], college: str) -> List[str]:
+    keys = ["all"] + [f"company:{company}" for company in companies]
+    if college:
+        keys.append(f"college:{college}")
+    return keys
+
+def stat_key(value: str) -> str:
+    # Test types become field names in cohort_stats
+    return value.replace(".", "_").replace("$", "_")
+
+async def update_readiness_entry(
+    user: User,
+    fields: Optional[dict] = None,
+    test_type: Optional[str] = None,
+    test_score: Optional[float] = None
+):
+    """Apply one change to the user's leaderboard entry and the cohort stats.
+
+    `fields` may set roadmap_progress and/or companies. A test_score is added
+    to the running test average. The entry update returns the previous
+    readiness and cohorts, so cohort stats are adjusted with $inc only.
+    """
+    try:
+        values = {"user_name": user.name, "college": user.college, **(fields or {})}
+        test_added = 1 if test_score is not None else 0
+        
+        stage = {
+            "roadmap_progress": {"$ifNull": ["$roadmap_progress", 0]},
+            "companies": {"$ifNull": ["$companies", []]},
+            "test_count": {"$add": [{"$ifNull": ["$test_count", 0]}, test_added]},
+            "score_sum": {"$add": [{"$ifNull": ["$score_sum", 0]}, test_score or 0]},
+            "updated_at": datetime.now(timezone.utc),
+        }
+        stage.update({key: {"$literal": value} for key, value in values.items()})
+        
+        test_average = {"$cond": [{"$gt": ["$test_count", 0]}, {"$divide": ["$score_sum", "$test_count"]}, 0]}
+        entry = await db.readiness_board.find_one_and_update(
+            {"user_id": user.id},
+            [
+                {"$set": {"previous_readiness": "$readiness", "previous_cohorts": "$cohorts"}},
+                {"$set": stage},
+                {"$set": {
+                    "readiness": {"$min": [100, {"$add": [
+                        {"$multiply": ["$roadmap_progress", 0.5]},
+                        {"$multiply": [test_average, 0.5]}
+                    ]}]},
+                    "cohorts": {"$concatArrays": [
+                        ["all"],
+                        {"$map": {"input": "$companies", "in": {"$concat": ["company:", "$$this"]}}},
+                        {"$cond": [{"$gt": [{"$strLenCP": "$college"}, 0]}, [{"$concat": ["college:", "$college"]}], []]}
+                    ]}
+                }}
+            ],
+            projection={"_id": 0, "readiness": 1, "cohorts": 1, "previous_readiness": 1, "previous_cohorts": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        increments: Dict[str, Dict[str, float]] = {}
+        
+        def add(cohort: str, field: str, amount: float):
+            cohort_inc = increments.setdefault(cohort, {})
+            cohort_inc[field] = cohort_inc.get(field, 0) + amount
+        
+        new_readiness, new_cohorts = entry["readiness"], entry["cohorts"]
+        if "previous_readiness" in entry:
+            old_readiness = entry["previous_readiness"]
+            for cohort in entry.get("previous_cohorts") or []:
+                add(cohort, "members", -1)
+                add(cohort, "readiness_sum", -old_readiness)
+                add(cohort, f"readiness_hist.{readiness_bucket(old_readiness)}", -1)
+        for cohort in new_cohorts:
+            add(cohort, "members", 1)
+            add(cohort, "readiness_sum", new_readiness)
+            add(cohort, f"readiness_hist.{readiness_bucket(new_readiness)}", 1)
+        
+        if test_added:
+            prefix = f"tests.{stat_key(test_type or 'General')}"
+            for cohort in new_cohorts:
+                add(cohort, f"{prefix}.count", 1)
+                add(cohort, f"{prefix}.score_sum", test_score)
+                add(cohort, f"{prefix}.hist.{readiness_bucket(test_score)}", 1)
+        
+        operations = []
+        for cohort, inc in increments.items():
+            inc = {field: amount for field, amount in inc.items() if amount}
+            if inc:
+                operations.append(UpdateOne({"_id": cohort}, {"$inc": inc}, upsert=True))
+        if operations:
+            await db.cohort_stats.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error("Leaderboard update failed for user %s: %s", user.id, e)
+
+async def ensure_leaderboard_indexes():
+    await db.readiness_board.create_index("user_id", unique=True)
+    await db.readiness_board.create_index([("companies", 1), ("readiness", -1)])
+    await db.readiness_board.create_index([("college", 1), ("readiness", -1)])
+
+async def backfill_readiness_board():
+    """Build both views from existing data once, for users who predate them.
+
+    Guarded by a marker document so only one worker ever runs it. Updates
+    that arrive while it runs may be counted twice in cohort_stats.
+    """
+    try:
+        await db.migrations.insert_one({"_id": "readiness_board_v1", "started_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
+        return
+    
+    try:
+        roadmap_progress = {}
+        async for roadmap in db.roadmaps.find({}, {"_id": 0, "user_id": 1, "overall_progress": 1}):
+            roadmap_progress[roadmap["user_id"]] = roadmap.get("overall_progress", 0)
+        
+        companies = {}
+        async for goal in db.goals.find({}, {"_id": 0, "user_id": 1, "target_companies": 1}):
+            companies[goal["user_id"]] = goal.get("target_companies", [])
+        
+        test_totals = {}
+        async for row in db.mock_tests.aggregate([
+            {"$match": {"feedback": {"$nin": ["", None]}}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}, "score_sum": {"$sum": "$score"}}}
+        ]):
+            test_totals[row["_id"]] = (row["count"], row["score_sum"])
+        
+        cohorts_by_user = {}
+        stats: Dict[str, Dict[str, float]] = {}
+        
+        def add(cohort: str, field: str, amount: float):
+            cohort_stats = stats.setdefault(cohort, {})
+            cohort_stats[field] = cohort_stats.get(field, 0) + amount
+        
+        operations = []
+        async for user in db.users.find({}, {"_id": 0, "id": 1, "name": 1, "college": 1}):
+            user_id = user["id"]
+            test_count, score_sum = test_totals.get(user_id, (0, 0))
+            entry = {
+                "user_name": user.get("name", ""),
+                "college": user.get("college", ""),
+                "companies": companies.get(user_id, []),
+                "roadmap_progress": roadmap_progress.get(user_id, 0),
+                "test_count": test_count,
+                "score_sum": score_sum,
+                "updated_at": datetime.now(timezone.utc),
+            }
+            entry["readiness"] = compute_readiness(entry["roadmap_progress"], test_count, score_sum)
+            entry["cohorts"] = cohort_keys(entry["companies"], entry["college"])
+            cohorts_by_user[user_id] = entry["cohorts"]
+            
+            for cohort in entry["cohorts"]:
+                add(cohort, "members", 1)
+                add(cohort, "readiness_sum", entry["readiness"])
+                add(cohort, f"readiness_hist.{readiness_bucket(entry['readiness'])}", 1)
+            
+            operations.append(UpdateOne({"user_id": user_id}, {"$set": entry}, upsert=True))
+            if len(operations) >= 1000:
+                await db.readiness_board.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            await db.readiness_board.bulk_write(operations, ordered=False)
+        
+        async for test in db.mock_tests.find(
+            {"feedback": {"$nin": ["", None]}},
+            {"_id": 0, "user_id": 1, "test_type": 1, "score": 1}
+        ):
+            prefix = f"tests.{stat_key(test.get('test_type') or 'General')}"
+            score = test.get("score", 0)
+            for cohort in cohorts_by_user.get(test["user_id"], ["all"]):
+                add(cohort, f"{prefix}.count", 1)
+                add(cohort, f"{prefix}.score_sum", score)
+                add(cohort, f"{prefix}.hist.{readiness_bucket(score)}", 1)
+        
+        operations = [UpdateOne({"_id": cohort}, {"$inc": inc}, upsert=True) for cohort, inc in stats.items()]
+        for start in range(0, len(operations), 1000):
+            await db.cohort_stats.bulk_write(operations[start:start + 1000], ordered=False)
+        
+        logger.info("Backfilled leaderboard for %d users and %d cohorts", len(cohorts_by_user), len(stats))
+    except asyncio.CancelledError:
+        # Shut down mid-way - let the next start try again
+        await db.migrations.delete_one({"_id": "readiness_board_v1"})
+        raise
+    except Exception as e:
+        logger.error("Leaderboard backfill failed: %s", e)
+        await db.migrations.delete_one({"_id": "readiness_board_v1"})
+
+def format_cohort_stats(stats: dict) -> dict:
+    members = stats.get("members", 0)
+    readiness_hist = stats.get("readiness_hist", {})
+    tests = {}
+    for test_type, test_stats in stats.get("tests", {}).items():
+        count = test_stats.get("count", 0)
+        hist = test_stats.get("hist", {})
+        tests[test_type] = {
+            "count": count,
+            "average_score": test_stats.get("score_sum", 0) / count if count else 0.0,
+            "score_distribution": [hist.get(str(i), 0) for i in range(READINESS_BUCKETS)],
+        }
+    return {
+        "cohort": stats["_id"],
+        "members": members,
+        "average_readiness": stats.get("readiness_sum", 0) / members if members else 0.0,
+        "readiness_distribution": [readiness_hist.get(str(i), 0) for i in range(READINESS_BUCKETS)],
+        "tests": tests,
+    }
+
+# ===== EXPORTS =====
+
+# Rows fetched from MongoDB and written to the response per chunk
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+
+TEST_EXPORT_COLUMNS = ["id", "user_id", "test_type", "score", "total_questions", "correct_answers",
+                       "time_spent", "weak_areas", "feedback", "completed_at"]
+CHAT_EXPORT_COLUMNS = ["id", "user_id", "user_name", "company", "message", "message_type", "timestamp"]
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ";".join(str(v) for v in value)
+    return value
+
+async def stream_export(cursor, export_format: str, columns: List[str], compress: bool):
+    """Yield an export in chunks of EXPORT_BATCH_SIZE rows.
+
+    Only one batch is held in memory at a time, so the size of the export
+    doesn't matter. NDJSON rows carry the full document, CSV rows `columns`.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 -> gzip
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    rows = 0
+    
+    def take_chunk() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+    
+    if writer:
+        writer.writerow(columns)
+    
+    async for doc in cursor:
+        doc.pop("_id", None)
+        if writer:
+            writer.writerow([export_value(doc.get(column, "")) for column in columns])
+        else:
+            buffer.write(json.dumps(doc, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)))
+            buffer.write("\n")
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            chunk = take_chunk()
+            if chunk:
+                yield chunk
+    
+    chunk = take_chunk()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def export_response(cursor, name: str, export_format: str, columns: List[str], compress: bool) -> StreamingResponse:
+    if export_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    
+    filename = f"{name}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{export_format}"
+    media_type = "application/x-ndjson" if export_format == "ndjson" else "text/csv"
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        stream_export(cursor, export_format, columns, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ===== SKILL ANALYTICS =====
+
+class SkillSnapshot:
+    """Columnar in-memory copy of everyone's survey skill scores.
+
+    Scores live in one uint8 matrix (a row per user, a column per skill) and
+    every cohort ("company:<name>", "domain:<name>") keeps a histogram of its
+    members' scores, shape (cohorts, skills, 11). A percentile lookup is a
+    cumsum over 11 buckets, independent of cohort size. Refreshes only pull
+    surveys and goals changed since the last one and move those users'
+    counts between histograms.
+    """
+
+    SKILLS = list(SKILL_FIELDS)
+    MAX_SCORE = 10
+
+    def __init__(self):
+        self.user_rows: Dict[str, int] = {}
+        self.scores = np.zeros((1024, len(self.SKILLS)), dtype=np.uint8)
+        self.row_cohorts: List[List[int]] = []
+        self.cohort_ids: Dict[str, int] = {}
+        self.counts = np.zeros((0, len(self.SKILLS), self.MAX_SCORE + 1), dtype=np.int32)
+        self.survey_watermark: Optional[datetime] = None
+        self.goal_watermark: Optional[datetime] = None
+        self.refreshed_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+
+    def _cohort_id(self, key: str) -> int:
+        cohort_id = self.cohort_ids.get(key)
+        if cohort_id is None:
+            cohort_id = self.cohort_ids[key] = len(self.cohort_ids)
+            if cohort_id >= self.counts.shape[0]:
+                grown = np.zeros((max(16, cohort_id * 2), *self.counts.shape[1:]), dtype=self.counts.dtype)
+                grown[:self.counts.shape[0]] = self.counts
+                self.counts = grown
+        return cohort_id
+
+    def _user_cohorts(self, goal: Optional[dict]) -> List[int]:
+        if not goal:
+            return []
+        keys = [f"company:{company}" for company in goal.get("target_companies", [])]
+        if goal.get("preferred_domain"):
+            keys.append(f"domain:{goal['preferred_domain']}")
+        return [self._cohort_id(key) for key in dict.fromkeys(keys)]
+
+    def _clip_scores(self, survey: dict) -> List[int]:
+        return [min(max(int(survey.get(skill) or 1), 1), self.MAX_SCORE) for skill in self.SKILLS]
+
+    async def ensure_indexes(self):
+        # Incremental refreshes filter on these
+        await db.surveys.create_index("completed_at")
+        await db.goals.create_index("updated_at")
+
+    def _apply(self, row: int, cohorts: List[int], delta: int):
+        if cohorts:
+            skill_index = np.arange(len(self.SKILLS))
+            for cohort_id in cohorts:
+                self.counts[cohort_id, skill_index, self.scores[row]] += delta
+
+    def _upsert(self, user_id: str, survey: dict, goal: Optional[dict]) -> bool:
+        """Put the user's row in line with their survey and goal; False if it already was"""
+        scores = self._clip_scores(survey)
+        cohorts = self._user_cohorts(goal)
+        row = self.user_rows.get(user_id)
+        if row is None:
+            row = self.user_rows[user_id] = len(self.row_cohorts)
+            self.row_cohorts.append([])
+            if row >= self.scores.shape[0]:
+                self.scores = np.concatenate([self.scores, np.zeros_like(self.scores)])
+        elif self.row_cohorts[row] == cohorts and self.scores[row].tolist() == scores:
+            return False
+        else:
+            self._apply(row, self.row_cohorts[row], -1)
+        self.scores[row] = scores
+        self.row_cohorts[row] = cohorts
+        self._apply(row, self.row_cohorts[row], 1)
+        return True
+
+    def _rebuild_counts(self):
+        # Full build: scatter every (user, cohort) pair into the histograms at once
+        self.counts[:] = 0
+        pairs = [(row, cohort_id) for row, cohorts in enumerate(self.row_cohorts) for cohort_id in cohorts]
+        if not pairs:
+            return
+        rows, cohort_ids = np.array(pairs, dtype=np.int64).T
+        skill_index = np.arange(len(self.SKILLS))
+        np.add.at(
+            self.counts,
+            (cohort_ids[:, None], skill_index[None, :], self.scores[rows]),
+            1
+        )
+
+    async def refresh(self):
+        async with self._lock:
+            full = self.refreshed_at is None
+            survey_query = {} if full else {"completed_at": {"$gte": self.survey_watermark}}
+            goal_query = {} if full else {"updated_at": {"$gte": self.goal_watermark}}
+            survey_fields = {"_id": 0, "user_id": 1, "completed_at": 1, **{skill: 1 for skill in self.SKILLS}}
+            goal_fields = {"_id": 0, "user_id": 1, "target_companies": 1, "preferred_domain": 1, "updated_at": 1}
+            
+            surveys, goals = {}, {}
+            async for survey in db.surveys.find(survey_query, survey_fields):
+                surveys[survey["user_id"]] = survey
+            async for goal in db.goals.find(goal_query, goal_fields):
+                goals[goal["user_id"]] = goal
+            
+            if not full:
+                # A changed goal needs that user's survey and vice versa
+                missing_surveys = [user_id for user_id in goals if user_id not in surveys]
+                missing_goals = [user_id for user_id in surveys if user_id not in goals]
+                if missing_surveys:
+                    async for survey in db.surveys.find({"user_id": {"$in": missing_surveys}}, survey_fields):
+                        surveys[survey["user_id"]] = survey
+                if missing_goals:
+                    async for goal in db.goals.find({"user_id": {"$in": missing_goals}}, goal_fields):
+                        goals[goal["user_id"]] = goal
+            
+            for survey in surveys.values():
+                if survey.get("completed_at") and (self.survey_watermark is None or survey["completed_at"] > self.survey_watermark):
+                    self.survey_watermark = survey["completed_at"]
+            for goal in goals.values():
+                if goal.get("updated_at") and (self.goal_watermark is None or goal["updated_at"] > self.goal_watermark):
+                    self.goal_watermark = goal["updated_at"]
+            
+            # The $gte watermarks re-read the newest documents every time, so
+            # count the rows that actually changed rather than documents read
+            if full:
+                self.scores = np.zeros((max(1024, 2 * len(surveys)), len(self.SKILLS)), dtype=np.uint8)
+                for row, (user_id, survey) in enumerate(surveys.items()):
+                    self.user_rows[user_id] = row
+                    self.scores[row] = self._clip_scores(survey)
+                    self.row_cohorts.append(self._user_cohorts(goals.get(user_id)))
+                self._rebuild_counts()
+                changed = len(surveys)
+            else:
+                changed = sum(self._upsert(user_id, survey, goals.get(user_id)) for user_id, survey in surveys.items())
+            
+            self.refreshed_at = datetime.now(timezone.utc)
+            return changed
+
+    def percentiles(self, user_scores: np.ndarray, cohorts: List[str]) -> Dict[str, dict]:
+        """Mid-rank percentile of each score within each cohort, plus cohort mean"""
+        known = [cohort for cohort in cohorts if cohort in self.cohort_ids]
+        result = {}
+        if not known:
+            return result
+        
+        counts = self.counts[[self.cohort_ids[cohort] for cohort in known]].astype(np.int64)  # (cohorts, skills, 11)
+        sizes = counts[:, 0, :].sum(axis=1)
+        below = np.cumsum(counts, axis=2)
+        skill_index = np.arange(len(self.SKILLS))
+        scores = user_scores.astype(np.int64)
+        strictly_below = below[:, skill_index, scores - 1]
+        equal = counts[:, skill_index, scores]
+        safe_sizes = np.maximum(sizes, 1)[:, None]
+        percentile = (strictly_below + 0.5 * equal) / safe_sizes * 100
+        means = (counts * np.arange(self.MAX_SCORE + 1)).sum(axis=2) / safe_sizes
+        
+        for i, cohort in enumerate(known):
+            result[cohort] = {
+                "size": int(sizes[i]),
+                "skills": {
+                    skill: {
+                        "score": int(scores[k]),
+                        "percentile": round(float(percentile[i, k]), 1),
+                        "cohort_mean": round(float(means[i, k]), 2),
+                        "gap_to_mean": round(float(means[i, k] - scores[k]), 2),
+                    }
+                    for k, skill in enumerate(self.SKILLS)
+                }
+            }
+        return result
+
+skill_snapshot = SkillSnapshot()
+SKILL_SNAPSHOT_REFRESH_SECONDS = float(os.environ.get("SKILL_SNAPSHOT_REFRESH_SECONDS", "60"))
+
+async def refresh_skill_snapshot_periodically():
+    while True:
+        try:
+            changed = await skill_snapshot.refresh()
+            if changed:
+                logger.info("Skill snapshot refreshed with %d changed survey(s)", changed)
+        except Exception as e:
+            logger.error("Skill snapshot refresh failed: %s", e)
+        await asyncio.sleep(SKILL_SNAPSHOT_REFRESH_SECONDS)
+
+# ===== ROADMAP REUSE =====
+
+# Each part of the profile vector is scaled so that no single block dominates
+# the cosine similarity; skills and domain matter most for roadmap content.
+PROFILE_WEIGHTS = {"skills": 2.0, "domain": 2.0, "companies": 1.0, "languages": 0.5, "practice_hours": 0.5}
+MAX_PRACTICE_HOURS = 12
+
+def encode_profile(snapshot: Dict[str, Any]) -> np.ndarray:
+    """Fixed-length unit vector for a roadmap profile snapshot"""
+    skills = snapshot.get("skills", {})
+    parts = [
+        # Centred, so uniformly weak and uniformly strong profiles point in opposite directions
+        np.array([(skills.get(field, 5.5) - 5.5) / 4.5 for field in SKILL_FIELDS], dtype=np.float32) * PROFILE_WEIGHTS["skills"],
+        np.array([domain == snapshot.get("preferred_domain") for domain in TECH_DOMAINS], dtype=np.float32) * PROFILE_WEIGHTS["domain"],
+        np.array([company in snapshot.get("target_companies", []) for company in COMPANIES], dtype=np.float32) * PROFILE_WEIGHTS["companies"],
+        np.array([language in snapshot.get("programming_languages", []) for language in PROGRAMMING_LANGUAGES], dtype=np.float32) * PROFILE_WEIGHTS["languages"],
+        np.array([min(snapshot.get("coding_practice_hours", 0), MAX_PRACTICE_HOURS) / MAX_PRACTICE_HOURS - 0.5], dtype=np.float32) * PROFILE_WEIGHTS["practice_hours"],
+    ]
+    vector = np.concatenate(parts)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class RoadmapReuseIndex:
+    """Profile vectors of users with an AI-generated roadmap.
+
+    A lookup is one matrix-vector product over all rows. Only AI roadmaps are
+    indexed, so reused roadmaps are never copied from copies.
+    """
+
+    def __init__(self, threshold: float, enabled: bool = True):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.dimensions = len(encode_profile({}))
+        self.vectors = np.zeros((1024, self.dimensions), dtype=np.float32)
+        self.user_ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free_rows: List[int] = []
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "stale_neighbours": 0, "fresh_requests": 0,
+                      "hit_similarity_sum": 0.0, "topics_dropped": 0, "topics_added": 0}
+
+    def add(self, user_id: str, snapshot: Dict[str, Any]):
+        row = self.rows.get(user_id)
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+                self.user_ids[row] = user_id
+            else:
+                row = len(self.user_ids)
+                self.user_ids.append(user_id)
+                if row >= self.vectors.shape[0]:
+                    self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.rows[user_id] = row
+        self.vectors[row] = encode_profile(snapshot)
+
+    def remove(self, user_id: str):
+        row = self.rows.pop(user_id, None)
+        if row is not None:
+            self.vectors[row] = 0  # zero vectors never clear the threshold
+            self.user_ids[row] = None
+            self.free_rows.append(row)
+
+    def nearest(self, user_id: str, snapshot: Dict[str, Any]) -> tuple:
+        """(neighbour user id, similarity) of the closest other user, or (None, 0.0)"""
+        count = len(self.user_ids)
+        if not count:
+            return None, 0.0
+        similarities = self.vectors[:count] @ encode_profile(snapshot)
+        own_row = self.rows.get(user_id)
+        if own_row is not None:
+            similarities[own_row] = -1.0
+        best = int(np.argmax(similarities))
+        return self.user_ids[best], float(similarities[best])
+
+    async def find_reusable(self, user_id: str, snapshot: Dict[str, Any]) -> Optional[dict]:
+        """The stored roadmap of a close enough neighbour, if there is one"""
+        if not self.enabled:
+            return None
+        self.stats["lookups"] += 1
+        neighbour_id, similarity = self.nearest(user_id, snapshot)
+        if neighbour_id is None or similarity < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        
+        neighbour = await db.roadmaps.find_one({"user_id": neighbour_id}, {"_id": 0})
+        # The neighbour may have regenerated or refreshed since it was indexed
+        if (not neighbour or neighbour.get("source", "ai") != "ai"
+                or float(encode_profile(neighbour.get("profile_snapshot", {})) @ encode_profile(snapshot)) < self.threshold):
+            self.stats["stale_neighbours"] += 1
+            self.stats["misses"] += 1
+            self.remove(neighbour_id)
+            return None
+        
+        self.stats["hits"] += 1
+        self.stats["hit_similarity_sum"] += similarity
+        return neighbour
+
+    def report(self) -> dict:
+        stats = dict(self.stats)
+        similarity_sum = stats.pop("hit_similarity_sum")
+        hits = stats["hits"]
+        return {
+            **stats,
+            "indexed_profiles": len(self.rows),
+            "threshold": self.threshold,
+            "hit_rate": hits / stats["lookups"] if stats["lookups"] else 0.0,
+            "mean_hit_similarity": similarity_sum / hits if hits else None,
+            "mean_topics_changed_per_hit": (stats["topics_dropped"] + stats["topics_added"]) / hits if hits else None,
+        }
+
+    async def build(self):
+        count = 0
+        async for roadmap in db.roadmaps.find(
+            {"source": {"$nin": ["reused", "fallback"]}, "profile_snapshot.skills": {"$exists": True}},
+            {"_id": 0, "user_id": 1, "profile_snapshot": 1}
+        ):
+            self.add(roadmap["user_id"], roadmap["profile_snapshot"])
+            count += 1
+        logger.info("Roadmap reuse index built with %d profiles", count)
+
+roadmap_reuse = RoadmapReuseIndex(
+    threshold=float(os.environ.get("ROADMAP_REUSE_THRESHOLD", "0.97")),
+    enabled=os.environ.get("ROADMAP_REUSE_ENABLED", "true").lower() == "true"
+)
+
+def adapt_reused_roadmap(neighbour: dict, goal: Goal, survey: SurveyResponse, snapshot: Dict[str, Any]) -> List[RoadmapItem]:
+    """Fit a neighbour's roadmap to this user without calling Gemini.
+
+    Progress is cleared, topics whose focus doesn't apply to this user are
+    dropped and replaced with the matching default topics, and skill topics
+    are re-prioritized by this user's own scores.
+    """
+    neighbour_snapshot = neighbour.get("profile_snapshot", {})
+    stale, needed = diff_roadmap_inputs(neighbour_snapshot, snapshot)
+    
+    items = []
+    for item_dict in neighbour.get("roadmap_items", []):
+        item = RoadmapItem(**{**item_dict, "completed": False, "completed_at": None})
+        item.focus = infer_item_focus(item, neighbour_snapshot)
+        if item.focus in stale:
+            roadmap_reuse.stats["topics_dropped"] += 1
+            continue
+        kind, _, field = item.focus.partition(":")
+        if kind == "skill" and field in SKILL_FIELDS:
+            item.priority = "High" if getattr(survey, field) < WEAK_SKILL_THRESHOLD else "Medium"
+        items.append(item)
+    
+    if needed:
+        topics = {item.topic for item in items}
+        replacements = [
+            item for item in default_roadmap_items(goal, survey)
+            if item.focus in needed and item.topic not in topics
+        ][:max(MAX_ROADMAP_ITEMS - len(items), 0)]
+        roadmap_reuse.stats["topics_added"] += len(replacements)
+        items += replacements
+    
+    return items
+
+# ===== MOCK TEST SESSIONS =====
+
+class TestSessionStore:
+    """Started mock tests, answer key included, held until they are submitted.
+
+    Only completed tests are written to db.mock_tests; a test that is never
+    submitted just expires. With write-ahead on, sessions are also kept in
+    db.test_sessions (removed by a TTL index) so they survive a restart and
+    can be submitted to any worker.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: int, write_ahead: bool):
+        self.ttl_seconds = ttl_seconds
+        self.write_ahead = write_ahead
+        self.sessions = TTLCache(maxsize=max_sessions, ttl=ttl_seconds)
+
+    async def ensure_indexes(self):
+        await db.mock_tests.create_index("id")  # already-submitted check on a miss
+        if self.write_ahead:
+            await db.test_sessions.create_index("id", unique=True)
+            await db.test_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+    async def start(self, session: dict):
+        session["expires_at"] = session["started_at"] + timedelta(seconds=self.ttl_seconds)
+        self.sessions[session["id"]] = session
+        if self.write_ahead:
+            await db.test_sessions.insert_one(dict(session))  # insert_one adds _id to the dict it's given
+
+    async def get(self, test_id: str, user_id: str) -> Optional[dict]:
+        session = self.sessions.get(test_id)
+        if session is None and self.write_ahead:
+            # The TTL monitor only runs once a minute, so check expiry here too
+            session = await db.test_sessions.find_one(
+                {"id": test_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0}
+            )
+            if session:
+                self.sessions[test_id] = session
+        if session is None or session["user_id"] != user_id:
+            return None
+        return session
+
+    async def save(self, session: dict, fields: List[str]):
+        """Write changed fields of a session that is being answered step by step"""
+        if self.write_ahead:
+            await db.test_sessions.update_one({"id": session["id"]}, {"$set": {field: session[field] for field in fields}})
+
+    async def claim(self, test_id: str, user_id: str) -> Optional[dict]:
+        """Remove and return the session, so a test can only be submitted once"""
+        session = self.sessions.get(test_id)
+        if session is not None and session["user_id"] != user_id:
+            return None
+        self.sessions.pop(test_id, None)
+        if self.write_ahead:
+            # Whoever deletes the stored copy owns the submission, even across workers
+            session = await db.test_sessions.find_one_and_delete(
+                {"id": test_id, "user_id": user_id, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                projection={"_id": 0}
+            )
+        return session
+
+test_sessions = TestSessionStore(
+    max_sessions=int(os.environ.get("TEST_SESSION_MAX", "10000")),
+    ttl_seconds=int(os.environ.get("TEST_SESSION_TTL_SECONDS", "7200")),
+    write_ahead=os.environ.get("TEST_SESSION_WRITE_AHEAD", "false").lower() == "true"
+)
+
+def public_test_session(session: dict) -> MockTestSession:
+    return MockTestSession(
+        **{key: session[key] for key in ("id", "user_id", "test_type", "total_questions", "started_at", "expires_at")},
+        adaptive=session.get("adaptive", False),
+        questions=[PublicTestQuestion(**question) for question in session["questions"]]
+    )
+
+# ===== ADAPTIVE TESTING =====
+
+# Questions carry three-parameter logistic (3PL) item parameters: a is how
+# sharply the question separates weaker from stronger candidates, b its
+# difficulty on the ability scale (0 is average) and c the chance of guessing
+# right. QUESTION_BANK_PATH can point at a JSON list of the same shape.
+ADAPTIVE_QUESTIONS = [
+    {"test_type": "DSA", "topic": "Arrays", "question": "What is the time complexity of accessing an array element by index?",
+     "options": ["O(1)", "O(log n)", "O(n)", "O(n log n)"], "correct_answer": "O(1)", "a": 1.0, "b": -2.2, "c": 0.25},
+    {"test_type": "DSA", "topic": "Data Structures", "question": "Which data structure uses LIFO principle?",
+     "options": ["Queue", "Stack", "Array", "Tree"], "correct_answer": "Stack", "a": 1.1, "b": -1.8, "c": 0.25},
+    {"test_type": "DSA", "topic": "Time Complexity", "question": "What is the time complexity of binary search?",
+     "options": ["O(n)", "O(log n)", "O(n²)", "O(1)"], "correct_answer": "O(log n)", "a": 1.3, "b": -1.0, "c": 0.25},
+    {"test_type": "DSA", "topic": "Sorting", "question": "What is the worst-case time complexity of quick sort?",
+     "options": ["O(n log n)", "O(n²)", "O(n)", "O(log n)"], "correct_answer": "O(n²)", "a": 1.2, "b": -0.3, "c": 0.25},
+    {"test_type": "DSA", "topic": "Hashing", "question": "What is the average time to look up a key in a hash table?",
+     "options": ["O(1)", "O(log n)", "O(n)", "O(n²)"], "correct_answer": "O(1)", "a": 1.0, "b": -0.8, "c": 0.25},
+    {"test_type": "DSA", "topic": "Graphs", "question": "Which algorithm finds shortest paths from one source with non-negative edge weights?",
+     "options": ["Kruskal", "Dijkstra", "Prim", "Topological sort"], "correct_answer": "Dijkstra", "a": 1.4, "b": 0.2, "c": 0.25},
+    {"test_type": "DSA", "topic": "Trees", "question": "What is the height of a balanced binary search tree with n nodes?",
+     "options": ["O(1)", "O(log n)", "O(n)", "O(n log n)"], "correct_answer": "O(log n)", "a": 1.2, "b": 0.5, "c": 0.25},
+    {"test_type": "DSA", "topic": "Heaps", "question": "Building a binary heap from n unsorted elements takes at best:",
+     "options": ["O(n)", "O(n log n)", "O(log n)", "O(n²)"], "correct_answer": "O(n)", "a": 1.5, "b": 1.3, "c": 0.25},
+    {"test_type": "DSA", "topic": "Dynamic Programming", "question": "The 0/1 knapsack DP with n items and capacity W runs in:",
+     "options": ["O(nW)", "O(n log W)", "O(2^n)", "O(n + W)"], "correct_answer": "O(nW)", "a": 1.6, "b": 1.8, "c": 0.25},
+    {"test_type": "DSA", "topic": "Graphs", "question": "Which algorithm finds strongly connected components with two depth-first searches?",
+     "options": ["Tarjan", "Kosaraju", "Bellman-Ford", "Floyd-Warshall"], "correct_answer": "Kosaraju", "a": 1.5, "b": 2.3, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Percentages", "question": "What is 15% of 200?",
+     "options": ["20", "25", "30", "35"], "correct_answer": "30", "a": 0.9, "b": -2.0, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Ratios", "question": "Divide 120 in the ratio 3:5. What is the larger part?",
+     "options": ["45", "60", "75", "80"], "correct_answer": "75", "a": 1.1, "b": -1.2, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Speed and Distance", "question": "A train covers 180 km in 3 hours. What is its speed in m/s?",
+     "options": ["15", "16.67", "18", "60"], "correct_answer": "16.67", "a": 1.2, "b": -0.4, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Time and Work", "question": "A finishes a job in 10 days and B in 15. How many days together?",
+     "options": ["5", "6", "7.5", "12.5"], "correct_answer": "6", "a": 1.3, "b": 0.1, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Profit and Loss", "question": "An item bought for 800 is sold for 920. What is the profit percentage?",
+     "options": ["12%", "13%", "15%", "20%"], "correct_answer": "15%", "a": 1.1, "b": -0.6, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Probability", "question": "Two fair dice are rolled. What is the probability the sum is 7?",
+     "options": ["1/6", "1/12", "5/36", "7/36"], "correct_answer": "1/6", "a": 1.4, "b": 0.7, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Permutations", "question": "In how many ways can the letters of LEVEL be arranged?",
+     "options": ["120", "60", "30", "20"], "correct_answer": "30", "a": 1.5, "b": 1.4, "c": 0.25},
+    {"test_type": "Aptitude", "topic": "Number Series", "question": "What comes next: 2, 6, 12, 20, 30, ?",
+     "options": ["40", "42", "44", "36"], "correct_answer": "42", "a": 1.2, "b": 0.3, "c": 0.25},
+    {"test_type": "Technical", "topic": "OOP", "question": "Which OOP principle hides internal state behind methods?",
+     "options": ["Inheritance", "Encapsulation", "Polymorphism", "Abstraction"], "correct_answer": "Encapsulation", "a": 1.0, "b": -1.9, "c": 0.25},
+    {"test_type": "Technical", "topic": "Networking", "question": "Which protocol does DNS mainly use for queries?",
+     "options": ["TCP", "UDP", "ICMP", "SCTP"], "correct_answer": "UDP", "a": 1.2, "b": -0.5, "c": 0.25},
+    {"test_type": "Technical", "topic": "DBMS", "question": "Which normal form removes transitive dependencies?",
+     "options": ["1NF", "2NF", "3NF", "4NF"], "correct_answer": "3NF", "a": 1.3, "b": 0.0, "c": 0.25},
+    {"test_type": "Technical", "topic": "Operating Systems", "question": "Which condition is NOT required for deadlock?",
+     "options": ["Mutual exclusion", "Hold and wait", "Preemption", "Circular wait"], "correct_answer": "Preemption", "a": 1.4, "b": 0.6, "c": 0.25},
+    {"test_type": "Technical", "topic": "DBMS", "question": "Which isolation level prevents phantom reads?",
+     "options": ["Read uncommitted", "Read committed", "Repeatable read", "Serializable"], "correct_answer": "Serializable", "a": 1.5, "b": 1.2, "c": 0.25},
+    {"test_type": "Technical", "topic": "Operating Systems", "question": "What does a TLB cache?",
+     "options": ["Disk blocks", "Page table entries", "Instructions", "Socket buffers"], "correct_answer": "Page table entries", "a": 1.4, "b": 1.0, "c": 0.25},
+    {"test_type": "Technical", "topic": "Networking", "question": "Which TCP mechanism halves the congestion window on packet loss?",
+     "options": ["Slow start", "Fast retransmit", "AIMD", "Nagle's algorithm"], "correct_answer": "AIMD", "a": 1.6, "b": 1.9, "c": 0.25},
+    {"test_type": "Technical", "topic": "OOP", "question": "Method overloading is resolved at:",
+     "options": ["Compile time", "Run time", "Link time", "Load time"], "correct_answer": "Compile time", "a": 1.1, "b": -0.9, "c": 0.25},
+]
+
+ABILITY_GRID = np.linspace(-4.0, 4.0, 161)
+IRT_SCALE = 1.702  # brings the logistic curve in line with the normal ogive
+
+class ItemBank:
+    """Precomputed 3PL tables for one test type's questions.
+
+    Response probabilities and item information are evaluated once for every
+    point of ABILITY_GRID, so estimating ability is a sum over the answered
+    rows and picking the next question is an argmax over one row.
+    """
+
+    def __init__(self, questions: List[dict], top_k: int = 1):
+        self.questions = questions
+        self.top_k = top_k  # pick at random among the k best so the same opener isn't always used
+        a = np.array([question["a"] for question in questions], dtype=float)[:, None]
+        b = np.array([question["b"] for question in questions], dtype=float)[:, None]
+        c = np.array([question.get("c", 0.0) for question in questions], dtype=float)[:, None]
+        p = c + (1 - c) / (1 + np.exp(-IRT_SCALE * a * (ABILITY_GRID - b)))
+        p = np.clip(p, 1e-9, 1 - 1e-9)  # a certain answer would zero out the posterior
+        self.log_p = np.log(p)
+        self.log_q = np.log1p(-p)
+        information = (IRT_SCALE * a) ** 2 * ((p - c) / (1 - c)) ** 2 * (1 - p) / p
+        self.information = np.ascontiguousarray(information.T)  # one row per grid point
+        self.log_prior = -0.5 * ABILITY_GRID ** 2  # standard normal
+
+    def __len__(self):
+        return len(self.questions)
+
+    def estimate(self, asked: List[int], correct: List[bool]) -> tuple:
+        """(ability, standard error): mean and spread of the posterior over the grid"""
+        asked = np.asarray(asked, dtype=np.intp)
+        correct = np.asarray(correct, dtype=bool)
+        log_posterior = self.log_prior + self.log_p[asked[correct]].sum(axis=0) + self.log_q[asked[~correct]].sum(axis=0)
+        weights = np.exp(log_posterior - log_posterior.max())
+        weights /= weights.sum()
+        ability = float(weights @ ABILITY_GRID)
+        return ability, float(np.sqrt(weights @ (ABILITY_GRID - ability) ** 2))
+
+    def select(self, ability: float, asked: List[int]) -> Optional[int]:
+        """The unasked question that tells us most about a candidate of this ability"""
+        remaining = len(self.questions) - len(asked)
+        if remaining <= 0:
+            return None
+        point = min(int(np.searchsorted(ABILITY_GRID, ability)), len(ABILITY_GRID) - 1)
+        row = self.information[point].copy()
+        row[asked] = -1.0
+        k = min(self.top_k, remaining)
+        if k == 1:
+            return int(np.argmax(row))
+        return int(np.random.choice(np.argpartition(row, -k)[-k:]))
+
+    def question(self, item: int) -> dict:
+        question = self.questions[item]
+        return {
+            "question_id": str(uuid.uuid4()),
+            "question": question["question"],
+            "options": question["options"],
+            "correct_answer": question["correct_answer"],
+            "topic": question.get("topic", ""),
+            "item": item,
+            "correct": None,  # set once answered
+        }
+
+ADAPTIVE_MAX_QUESTIONS = int(os.environ.get("ADAPTIVE_MAX_QUESTIONS", "10"))
+ADAPTIVE_TARGET_ERROR = float(os.environ.get("ADAPTIVE_TARGET_ERROR", "0.35"))  # stop once the estimate is this precise
+
+def load_item_banks() -> Dict[str, ItemBank]:
+    questions = ADAPTIVE_QUESTIONS
+    path = os.environ.get("QUESTION_BANK_PATH")
+    if path:
+        with open(path) as f:
+            questions = json.load(f)
+    by_type: Dict[str, List[dict]] = {}
+    for question in questions:
+        by_type.setdefault(question["test_type"], []).append(question)
+    top_k = int(os.environ.get("ADAPTIVE_TOP_K", "3"))
+    return {test_type: ItemBank(items, top_k) for test_type, items in by_type.items()}
+
+item_banks = load_item_banks()
+
+def ability_to_score(ability: float) -> float:
+    """Percentage of a standard normal population at or below this ability"""
+    return 50 * (1 + math.erf(ability / math.sqrt(2)))
+
+async def start_adaptive_test(user: User, test_type: str) -> MockTestSession:
+    bank = item_banks.get(test_type)
+    if not bank:
+        raise HTTPException(status_code=400, detail=f"No adaptive questions for {test_type}")
+    
+    session = {
+        "id": str(uuid.uuid4()),
+        "user_id": user.id,
+        "test_type": test_type,
+        "adaptive": True,
+        "questions": [bank.question(bank.select(0.0, []))],
+        "total_questions": min(ADAPTIVE_MAX_QUESTIONS, len(bank)),
+        "ability": 0.0,
+        "standard_error": 1.0,
+        "started_at": datetime.now(timezone.utc),
+    }
+    await test_sessions.start(session)
+    return public_test_session(session)
+
+# ===== CHAT ARCHIVE =====
+
+class ChatArchive:
+    """Moves old chat messages out of MongoDB into compressed files on disk.
+
+    chat_messages keeps each room's recent messages: those newer than
+    `hot_days` and, with `max_per_room`, only that many per room. Older
+    messages are written in batches to per-room, per-day NDJSON segments
+    (zstd if `zstandard` is installed, gzip otherwise), under a directory
+    named by the hex-encoded room name, and only then deleted
+    from MongoDB. get_chat_history reads the segments when a page goes past
+    what's still in the collection.
+
+    A segment is written in full before its messages are deleted, so a crash
+    in between can only leave duplicates, which the reader drops. Archiving
+    should run on one instance, or on instances sharing the archive disk.
+    """
+
+    def __init__(self, directory: str, hot_days: int, max_per_room: int, batch_size: int, enabled: bool):
+        self.directory = directory
+        self.hot_days = hot_days
+        self.max_per_room = max_per_room
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.extension = ".ndjson.zst" if zstandard else ".ndjson.gz"
+        self.archived_rooms: Optional[set] = None  # scanned from disk on first use
+
+    def room_dir(self, company: str) -> str:
+        # Room names come from URLs; hex can't spell "..", "/" or anything else special
+        return os.path.join(self.directory, company.encode().hex())
+
+    def _scan_rooms(self) -> set:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return set()
+        rooms = set()
+        for name in names:
+            try:
+                rooms.add(bytes.fromhex(name).decode())
+            except ValueError:
+                continue
+        return rooms
+
+    async def has_room(self, company: str) -> bool:
+        """Whether the room has archived messages, without touching the disk after the first call"""
+        if self.archived_rooms is None:
+            self.archived_rooms = await asyncio.to_thread(self._scan_rooms)
+        return company in self.archived_rooms
+
+    def write_segment(self, company: str, day: str, messages: List[dict]):
+        """Write one batch of a room's messages from the same UTC day"""
+        day_dir = os.path.join(self.room_dir(company), day)
+        os.makedirs(day_dir, exist_ok=True)
+        data = "".join(json.dumps(message, default=export_value) + "\n" for message in messages).encode()
+        data = zstandard.ZstdCompressor().compress(data) if zstandard else gzip.compress(data)
+        # Named after the first message, so re-archiving the same batch overwrites it
+        path = os.path.join(day_dir, f"{messages[0]['timestamp']:%H%M%S%f}-{messages[0]['id']}{self.extension}")
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def days(self, company: str) -> List[str]:
+        """Archived days for a room, newest first"""
+        try:
+            return sorted((day for day in os.listdir(self.room_dir(company)) if len(day) == 10), reverse=True)
+        except FileNotFoundError:
+            return []
+
+    def read_day(self, company: str, day: str) -> List[dict]:
+        day_dir = os.path.join(self.room_dir(company), day)
+        messages = {}
+        for name in sorted(os.listdir(day_dir)):
+            with open(os.path.join(day_dir, name), "rb") as f:
+                if name.endswith(".ndjson.gz"):
+                    data = gzip.decompress(f.read())
+                elif name.endswith(".ndjson.zst") and zstandard:
+                    data = zstandard.ZstdDecompressor().stream_reader(f).read()
+                else:
+                    continue
+            for line in data.splitlines():
+                message = json.loads(line)
+                timestamp = datetime.fromisoformat(message["timestamp"])
+                message["timestamp"] = timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+                messages[message["id"]] = message
+        return sorted(messages.values(), key=lambda message: message["timestamp"])
+
+    def older_messages(self, company: str, before: Optional[datetime], limit: int) -> List[dict]:
+        """Up to `limit` archived messages older than `before`, newest first"""
+        if before is not None and before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+        found: List[dict] = []
+        for day in self.days(company):
+            if before is not None and day > f"{before:%Y-%m-%d}":
+                continue
+            for message in reversed(self.read_day(company, day)):
+                if before is None or message["timestamp"] < before:
+                    found.append(message)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    async def cold_query(self, company: str) -> dict:
+        """The filter matching a room's messages that should leave the hot collection"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.hot_days)
+        query: Dict[str, Any] = {"company": company, "timestamp": {"$lt": cutoff}}
+        if self.max_per_room:
+            oldest_kept = await db.chat_messages.find(
+                {"company": company}, {"_id": 0, "timestamp": 1}
+            ).sort("timestamp", -1).skip(self.max_per_room - 1).limit(1).to_list(1)
+            if oldest_kept:
+                oldest_kept_at = oldest_kept[0]["timestamp"].replace(tzinfo=timezone.utc)
+                if oldest_kept_at > cutoff:
+                    query["timestamp"] = {"$lt": oldest_kept_at}
+        return query
+
+    async def archive_room(self, company: str) -> int:
+        query = await self.cold_query(company)
+        moved = 0
+        while True:
+            batch = await db.chat_messages.find(query).sort([("timestamp", 1), ("_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                return moved
+            by_day: Dict[str, List[dict]] = {}
+            for message in batch:
+                by_day.setdefault(f"{message['timestamp']:%Y-%m-%d}", []).append(
+                    {key: value for key, value in message.items() if key != "_id"}
+                )
+            for day, messages in by_day.items():
+                await asyncio.to_thread(self.write_segment, company, day, messages)
+            if self.archived_rooms is not None:
+                self.archived_rooms.add(company)
+            await db.chat_messages.delete_many({"_id": {"$in": [message["_id"] for message in batch]}})
+            moved += len(batch)
+
+    async def run_once(self) -> int:
+        moved = 0
+        for company in await db.chat_messages.distinct("company"):
+            moved += await self.archive_room(company)
+        return moved
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                moved = await self.run_once()
+                if moved:
+                    logger.info("Archived %d chat message(s)", moved)
+            except Exception as e:
+                logger.error("Chat archiving failed: %s", e)
+            await asyncio.sleep(interval)
+
+    async def ensure_indexes(self):
+        await db.chat_messages.create_index([("company", 1), ("timestamp", -1)])
+
+chat_archive = ChatArchive(
+    directory=os.environ.get("CHAT_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_archive")),
+    hot_days=int(os.environ.get("CHAT_HOT_DAYS", "30")),
+    max_per_room=int(os.environ.get("CHAT_HOT_MAX_PER_ROOM", "5000")),
+    batch_size=int(os.environ.get("CHAT_ARCHIVE_BATCH_SIZE", "1000")),
+    enabled=os.environ.get("CHAT_ARCHIVE_ENABLED", "false").lower() == "true"
+)
+CHAT_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("CHAT_ARCHIVE_INTERVAL_SECONDS", "3600"))
 
 # ===== API ROUTES =====
 
@@ -313,7 +2347,7 @@ async def register(user_data: UserCreate):
     
     return Token(access_token=token, token_type="bearer", user=user)
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, dependencies=[Depends(rate_limit_by_ip("auth_login"))])
 async def login(login_data: UserLogin):
     # Find user
     user_dict = await db.users.find_one({"email": login_data.email})
@@ -341,26 +2375,26 @@ async def update_profile(updates: dict, current_user: User = Depends(get_current
     )
     
     updated_user = await db.users.find_one({"id": current_user.id})
-    return User(**{k: v for k, v in updated_user.items() if k != "password"})
+    user = User(**{k: v for k, v in updated_user.items() if k != "password"})
+    if user.college != current_user.college or user.name != current_user.name:
+        spawn_background(update_readiness_entry(user))
+    return user
 
 @api_router.post("/goals", response_model=Goal)
 async def set_goals(goal_data: dict, current_user: User = Depends(get_current_user)):
-    goal = Goal(user_id=current_user.id, **goal_data)
+    # updated_at is always stamped here: the skill snapshot refreshes from it
+    clean_data = {k: v for k, v in goal_data.items() if k not in ['id', 'user_id', 'created_at', 'updated_at']}
+    goal = Goal(user_id=current_user.id, **clean_data)
     
-    # Check if goals already exist for this user
-    existing_goal = await db.goals.find_one({"user_id": current_user.id})
-    
-    if existing_goal:
-        # Update existing goals
-        await db.goals.update_one(
-            {"user_id": current_user.id},
-            {"$set": goal.dict()}
-        )
-    else:
-        # Insert new goals
-        await db.goals.insert_one(goal.dict())
-    
-    return goal
+    # Keep the id and created_at of existing goals
+    goal_dict = await upsert_user_document(
+        db.goals,
+        current_user.id,
+        goal.dict(exclude={"id", "created_at"}),
+        on_insert={"id": goal.id, "created_at": goal.created_at}
+    )
+    spawn_background(update_readiness_entry(current_user, {"companies": goal.target_companies}))
+    return Goal(**goal_dict)
 
 @api_router.get("/goals", response_model=Optional[Goal])
 async def get_goals(current_user: User = Depends(get_current_user)):
@@ -370,35 +2404,25 @@ async def get_goals(current_user: User = Depends(get_current_user)):
 @api_router.post("/survey", response_model=SurveyResponse)
 async def submit_survey(survey_data: dict, current_user: User = Depends(get_current_user)):
     try:
-        logger.info(f"Survey submission from user {current_user.id}: {survey_data}")
+        logger.debug("Survey submission from user %s: %s", current_user.id, survey_data)
         
         # Remove id if present to avoid conflicts with model's auto-generated ID
-        clean_data = {k: v for k, v in survey_data.items() if k not in ['id', 'user_id']}
+        # completed_at is always stamped here: the skill snapshot refreshes from it
+        clean_data = {k: v for k, v in survey_data.items() if k not in ['id', 'user_id', 'completed_at']}
         
-        # Check if survey already exists for this user
-        existing_survey = await db.surveys.find_one({"user_id": current_user.id})
-        
-        if existing_survey:
-            # Update existing survey - preserve the existing ID and user_id
-            survey = SurveyResponse(
-                id=existing_survey["id"], 
-                user_id=current_user.id, 
-                **clean_data
-            )
-            await db.surveys.update_one(
-                {"user_id": current_user.id},
-                {"$set": survey.dict()}
-            )
-            logger.info(f"Updated existing survey for user {current_user.id}")
-        else:
-            # Create new survey with auto-generated ID
-            survey = SurveyResponse(user_id=current_user.id, **clean_data)
-            await db.surveys.insert_one(survey.dict())
-            logger.info(f"Created new survey for user {current_user.id}")
+        # Validate first, then create or update - an existing survey keeps its ID
+        survey = SurveyResponse(user_id=current_user.id, **clean_data)
+        survey_dict = await upsert_user_document(
+            db.surveys,
+            current_user.id,
+            survey.dict(exclude={"id"}),
+            on_insert={"id": survey.id}
+        )
+        logger.info("Saved survey for user %s", current_user.id)
         
-        return survey
+        return SurveyResponse(**survey_dict)
     except Exception as e:
-        logger.error(f"Survey submission error for user {current_user.id}: {str(e)}")
+        logger.error("Survey submission error for user %s: %s", current_user.id, e)
         raise HTTPException(status_code=500, detail=f"Survey submission failed: {str(e)}")
 
 @api_router.get("/survey", response_model=Optional[SurveyResponse])
@@ -406,190 +2430,78 @@ async def get_survey(current_user: User = Depends(get_current_user)):
     survey_dict = await db.surveys.find_one({"user_id": current_user.id})
     return SurveyResponse(**survey_dict) if survey_dict else None
 
-@api_router.post("/roadmap/generate", response_model=Roadmap)
-async def generate_roadmap(current_user: User = Depends(get_current_user)):
-    # Get user goals and survey
-    goal_dict = await db.goals.find_one({"user_id": current_user.id})
-    survey_dict = await db.surveys.find_one({"user_id": current_user.id})
-    
-    if not goal_dict or not survey_dict:
-        raise HTTPException(status_code=400, detail="Please complete your goals and skill survey first")
-    
-    goal = Goal(**goal_dict)
-    survey = SurveyResponse(**survey_dict)
-    
-    # Generate AI roadmap
-    prompt = f"""
-    Generate a highly personalized placement preparation roadmap based on this SPECIFIC user profile:
+@api_router.get("/skills/gap")
+async def get_skill_gap(cohort: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Percentile of each of the user's skills among people with the same targets.
 
-    USER PROFILE:
-    - Target Companies: {', '.join(goal.target_companies)}
-    - Domain: {goal.preferred_domain}
-    - Expected Salary: ₹{goal.expected_salary}
-    - Tech Stack: {', '.join(goal.tech_stack)}
-    
-    CURRENT SKILL LEVELS (1-10 scale):
-    - DSA: {survey.dsa_skill}/10
-    - Operating Systems: {survey.os_knowledge}/10 
-    - Database Management: {survey.dbms_skill}/10
-    - Object-Oriented Programming: {survey.oops_understanding}/10
-    - Computer Networks: {survey.networking_knowledge}/10
-    
-    EXPERIENCE PROFILE:
-    - Programming Languages: {', '.join(survey.programming_languages)}
-    - Projects Completed: {survey.project_count}
-    - Internship Experience: {'Yes' if survey.internship_experience else 'No'}
-    - Daily Practice Hours: {survey.coding_practice_hours}
-    
-    INSTRUCTIONS:
-    Create a UNIQUE roadmap with 15-20 learning topics that:
-    1. Focuses heavily on {goal.preferred_domain} specific skills
-    2. Prioritizes weak areas (skills rated below 7/10)
-    3. Matches {', '.join(goal.target_companies)} company requirements
-    4. Considers the user's current experience level
-    5. Includes domain-specific technologies from their tech stack: {', '.join(goal.tech_stack)}
-    
-    Each topic should have:
-    - topic: Clear, specific topic name
-    - description: 1-2 sentences explaining why it's important for this user
-    - priority: High/Medium/Low based on user's weak areas and target companies
-    - estimated_hours: Realistic hours needed based on current skill level
-    - resources: 2-3 specific resources (prefer user's programming languages when possible)
-    
-    Return ONLY a JSON array of objects with the above keys.
+    Defaults to every target company plus the preferred domain; pass e.g.
+    `cohort=company:Google` to ask about a single cohort.
     """
+    if skill_snapshot.refreshed_at is None:
+        await skill_snapshot.refresh()
     
-    ai_response = await get_ai_response(prompt, "You are an expert career coach specializing in tech placements. Create personalized roadmaps that address individual weaknesses and company-specific requirements.")
+    row = skill_snapshot.user_rows.get(current_user.id)
+    if row is not None:
+        user_scores = skill_snapshot.scores[row]
+    else:
+        # Survey submitted after the last refresh
+        survey_dict = await db.surveys.find_one({"user_id": current_user.id})
+        if not survey_dict:
+            raise HTTPException(status_code=400, detail="Please complete your skill survey first")
+        user_scores = np.array([survey_dict[skill] for skill in SkillSnapshot.SKILLS], dtype=np.uint8)
     
-    # Parse AI response and create roadmap items
-    roadmap_items = []
-    try:
-        import json
-        import re
-        
-        # First try to extract JSON array from response
-        start_idx = ai_response.find('[')
-        end_idx = ai_response.rfind(']') + 1
-        
-        if start_idx != -1 and end_idx != -1:
-            json_str = ai_response[start_idx:end_idx]
-            # Clean up any potential formatting issues
-            json_str = re.sub(r'\n\s*', ' ', json_str)  # Remove newlines
-            json_str = re.sub(r'}\s*{', '},{', json_str)  # Fix missing commas
-            
-            items_data = json.loads(json_str)
-            
-            for item in items_data[:20]:  # Limit to 20 items
-                # Ensure all required fields are present with defaults
-                roadmap_item = RoadmapItem(
-                    topic=item.get('topic', 'Learning Topic'),
-                    description=item.get('description', 'Important skill to master'),
-                    priority=item.get('priority', 'Medium'),
-                    estimated_hours=int(item.get('estimated_hours', 20)),
-                    resources=item.get('resources', ['Practice and study materials'])
-                )
-                roadmap_items.append(roadmap_item)
-                
-    except Exception as e:
-        print(f"Failed to parse AI response: {e}")
-        # Continue with fallback items
+    if cohort:
+        cohorts = [cohort]
+    else:
+        goal_dict = await db.goals.find_one({"user_id": current_user.id}, {"_id": 0, "target_companies": 1, "preferred_domain": 1})
+        if not goal_dict:
+            raise HTTPException(status_code=400, detail="Please set your goals first")
+        cohorts = [f"company:{company}" for company in goal_dict.get("target_companies", [])]
+        if goal_dict.get("preferred_domain"):
+            cohorts.append(f"domain:{goal_dict['preferred_domain']}")
     
-    # If parsing failed or returned no items, use enhanced personalized default items
-    if not roadmap_items:
-        # Get user's weak areas (skills below 7)
-        weak_skills = []
-        if survey.dsa_skill < 7:
-            weak_skills.extend(['DSA', 'Algorithms', 'Data Structures'])
-        if survey.os_knowledge < 7:
-            weak_skills.append('Operating Systems')
-        if survey.dbms_skill < 7:
-            weak_skills.append('Database Management')
-        if survey.oops_understanding < 7:
-            weak_skills.append('Object-Oriented Programming')
-        if survey.networking_knowledge < 7:
-            weak_skills.append('Computer Networks')
-        
-        # Domain-specific roadmaps
-        if 'Frontend' in goal.preferred_domain or 'Frontend Development' in goal.preferred_domain:
-            domain_items = [
-                RoadmapItem(topic="React.js Advanced Concepts", description="Master hooks, context, and state management for modern React applications", priority="High", estimated_hours=35, resources=["React Official Documentation", "Frontend Masters React Course", "React TypeScript Cheatsheet"]),
-                RoadmapItem(topic="JavaScript ES6+ Features", description="Deep dive into modern JavaScript features and async programming", priority="High", estimated_hours=25, resources=["MDN JavaScript Guide", "JavaScript.info", "ES6 Features Guide"]),
-                RoadmapItem(topic="CSS Grid & Flexbox Mastery", description="Master modern CSS layout techniques for responsive design", priority="High", estimated_hours=20, resources=["CSS Grid Guide", "Flexbox Froggy", "CSS-Tricks Flexbox Guide"]),
-                RoadmapItem(topic="Frontend Performance Optimization", description="Learn techniques to optimize web application performance", priority="Medium", estimated_hours=30, resources=["Web.dev Performance", "Chrome DevTools Guide", "Frontend Performance Checklist"])
-            ]
-        elif 'Backend' in goal.preferred_domain or 'Full Stack' in goal.preferred_domain:
-            domain_items = [
-                RoadmapItem(topic="REST API Design Principles", description="Master RESTful API design and best practices", priority="High", estimated_hours=25, resources=["REST API Tutorial", "API Design Best Practices", "Postman API Testing"]),
-                RoadmapItem(topic="Database Optimization", description="Learn query optimization and database performance tuning", priority="High", estimated_hours=35, resources=["SQL Performance Tuning", "Database Indexing Guide", "Query Optimization Techniques"]),
-                RoadmapItem(topic="Microservices Architecture", description="Understand distributed systems and microservices patterns", priority="Medium", estimated_hours=40, resources=["Microservices Patterns", "System Design Primer", "Docker & Kubernetes Basics"])
-            ]
-        elif 'Data Science' in goal.preferred_domain or 'Machine Learning' in goal.preferred_domain:
-            domain_items = [
-                RoadmapItem(topic="Statistics and Probability", description="Master statistical concepts essential for data analysis", priority="High", estimated_hours=30, resources=["Khan Academy Statistics", "Think Stats", "Statistical Learning with R"]),
-                RoadmapItem(topic="Machine Learning Algorithms", description="Understand supervised and unsupervised learning algorithms", priority="High", estimated_hours=45, resources=["Scikit-learn Documentation", "Andrew Ng ML Course", "Hands-on ML Book"]),
-                RoadmapItem(topic="Data Visualization", description="Learn to create meaningful visualizations and dashboards", priority="Medium", estimated_hours=25, resources=["Matplotlib/Seaborn Tutorials", "Tableau Basics", "D3.js for Web Viz"])
-            ]
-        else:
-            domain_items = []
-        
-        # Skill-based items (focus on weak areas)
-        skill_items = []
-        if 'DSA' in weak_skills:
-            skill_items.extend([
-                RoadmapItem(topic="Array and String Manipulation", description="Master fundamental array and string algorithms", priority="High", estimated_hours=25, resources=["LeetCode Array Problems", "GeeksforGeeks Arrays", "Striver's A2Z DSA Sheet"]),
-                RoadmapItem(topic="Dynamic Programming Mastery", description="Solve complex optimization problems using DP", priority="High", estimated_hours=35, resources=["DP Playlist by Aditya Verma", "LeetCode DP Problems", "CSES Problem Set"])
-            ])
-        
-        if 'Operating Systems' in weak_skills:
-            skill_items.append(
-                RoadmapItem(topic="Process Management & Threading", description="Understand process scheduling and synchronization", priority="Medium", estimated_hours=20, resources=["Operating System Concepts", "GeeksforGeeks OS", "YouTube OS Tutorials"])
-            )
-        
-        # Core technical items
-        core_items = [
-            RoadmapItem(topic="System Design Fundamentals", description="Learn scalability patterns and distributed system concepts", priority="High", estimated_hours=30, resources=["System Design Primer", "Designing Data Intensive Applications", "High Scalability Blog"]),
-            RoadmapItem(topic="Git and Version Control", description="Master collaborative development with Git workflows", priority="Medium", estimated_hours=15, resources=["Git Documentation", "Atlassian Git Tutorials", "GitHub Workflow Guide"]),
-            RoadmapItem(topic="Testing and Debugging", description="Learn unit testing and debugging methodologies", priority="Medium", estimated_hours=25, resources=["Testing Best Practices", f"{survey.programming_languages[0] if survey.programming_languages else 'Python'} Testing Framework", "Debugging Techniques"]),
-            RoadmapItem(topic="Code Review and Best Practices", description="Understand clean code principles and review processes", priority="Medium", estimated_hours=20, resources=["Clean Code Book", "Code Review Best Practices", "Refactoring Techniques"])
-        ]
-        
-        # Company-specific items
-        company_items = []
-        if 'Google' in goal.target_companies or 'Microsoft' in goal.target_companies:
-            company_items.append(
-                RoadmapItem(topic="Advanced Algorithm Optimization", description="Master complex algorithms for FAANG interviews", priority="High", estimated_hours=40, resources=["Elements of Programming Interviews", "Cracking the Coding Interview", "LeetCode Hard Problems"])
-            )
-        
-        # Combine all items based on user profile
-        all_items = domain_items + skill_items + core_items + company_items
-        
-        # Select top 15 items, prioritizing High priority items
-        high_priority = [item for item in all_items if item.priority == "High"]
-        medium_priority = [item for item in all_items if item.priority == "Medium"]
-        
-        roadmap_items = (high_priority + medium_priority)[:15]
+    return {
+        "cohorts": skill_snapshot.percentiles(user_scores, cohorts),
+        "snapshot_refreshed_at": skill_snapshot.refreshed_at
+    }
+
+@api_router.post("/roadmap/generate", response_model=Roadmap, dependencies=[Depends(rate_limit_by_user("roadmap_generate"))])
+async def generate_roadmap(fresh: bool = False, current_user: User = Depends(get_current_user)):
+    """Build the user's roadmap. Pass `fresh=true` to skip reusing a similar user's roadmap."""
+    # Get user goals and survey
+    goal, survey = await load_goal_and_survey(current_user.id)
+    snapshot = roadmap_profile_snapshot(goal, survey)
+    
+    # A close enough neighbour's roadmap saves the Gemini call entirely
+    reused = None if fresh else await roadmap_reuse.find_reusable(current_user.id, snapshot)
+    if reused:
+        roadmap_items, source = adapt_reused_roadmap(reused, goal, survey, snapshot), "reused"
+    else:
+        roadmap_items, source = await build_roadmap_items(goal, survey, snapshot)
     
     # Create roadmap with proper progress calculation
     company = goal.target_companies[0] if goal.target_companies else "General"
     
-    # Calculate initial progress (all items start as incomplete)
-    total_items = len(roadmap_items)
-    completed_items = sum(1 for item in roadmap_items if item.completed)
-    initial_progress = (completed_items / total_items * 100) if total_items > 0 else 0.0
-    
     roadmap = Roadmap(
         user_id=current_user.id,
         target_company=company,
         domain=goal.preferred_domain,
         roadmap_items=roadmap_items,
-        overall_progress=initial_progress
+        overall_progress=calculate_roadmap_progress(roadmap_items),
+        profile_snapshot=snapshot,
+        source=source
     )
     
-    # Delete any existing roadmap for this user first
-    await db.roadmaps.delete_many({"user_id": current_user.id})
-    
-    await db.roadmaps.insert_one(roadmap.dict())
-    return roadmap
+    # Replaces any existing roadmap for this user
+    roadmap_dict = await upsert_user_document(db.roadmaps, current_user.id, roadmap.dict())
+    if fresh:
+        roadmap_reuse.stats["fresh_requests"] += 1
+    if source == "ai":
+        roadmap_reuse.add(current_user.id, snapshot)
+    else:
+        roadmap_reuse.remove(current_user.id)
+    spawn_background(update_readiness_entry(current_user, {"roadmap_progress": roadmap.overall_progress}))
+    return Roadmap(**roadmap_dict)
 
 @api_router.get("/roadmap", response_model=Optional[Roadmap])
 async def get_roadmap(current_user: User = Depends(get_current_user)):
@@ -609,49 +2521,194 @@ async def reset_roadmap(current_user: User = Depends(get_current_user)):
             "deleted_count": result.deleted_count
         }
     except Exception as e:
-        logging.error(f"Reset roadmap error: {e}")
+        logger.error("Reset roadmap error: %s", e)
         raise HTTPException(status_code=500, detail="Failed to reset roadmap")
 
-@api_router.put("/roadmap/progress")
-async def update_progress(updates: dict, current_user: User = Depends(get_current_user)):
-    task_topic = updates.get("task_topic")
-    completed = updates.get("completed", False)
-    
-    roadmap_dict = await db.roadmaps.find_one({"user_id": current_user.id})
+# Topics requested per newly needed focus, by focus kind
+REFRESH_TOPICS_PER_FOCUS = {"skill": 2, "company": 1, "tech": 1, "domain": 3}
+MAX_ROADMAP_ITEMS = 20
+
+@api_router.post("/roadmap/refresh", dependencies=[Depends(rate_limit_by_user("roadmap_refresh"))])
+async def refresh_roadmap(current_user: User = Depends(get_current_user)):
+    """Bring the roadmap in line with changed goals/survey without starting over.
+
+    Topics whose focus no longer fits the profile are dropped, completed topics
+    are always kept, and Gemini is only asked for the replacement topics.
+    """
+    (goal, survey), roadmap_dict = await asyncio.gather(
+        load_goal_and_survey(current_user.id),
+        db.roadmaps.find_one({"user_id": current_user.id})
+    )
     if not roadmap_dict:
         raise HTTPException(status_code=404, detail="Roadmap not found")
     
-    # Update the specific task
-    update_query = {
-        "$set": {
-            f"roadmap_items.$[elem].completed": completed,
-            f"roadmap_items.$[elem].completed_at": datetime.now(timezone.utc) if completed else None,
-            "updated_at": datetime.now(timezone.utc)
-        }
-    }
+    roadmap = Roadmap(**roadmap_dict)
+    if not roadmap.profile_snapshot:
+        raise HTTPException(
+            status_code=409,
+            detail="This roadmap was created before incremental refresh was available, please reset and regenerate it"
+        )
     
-    await db.roadmaps.update_one(
-        {"user_id": current_user.id},
-        update_query,
-        array_filters=[{"elem.topic": task_topic}]
-    )
+    snapshot = roadmap_profile_snapshot(goal, survey)
+    stale, needed = diff_roadmap_inputs(roadmap.profile_snapshot, snapshot)
+    
+    kept, removed = [], []
+    for item in roadmap.roadmap_items:
+        item.focus = infer_item_focus(item, roadmap.profile_snapshot)
+        if item.completed or item.focus not in stale:
+            kept.append(item)
+        else:
+            removed.append(item)
+    
+    # Fill the freed slots, but never grow past the usual roadmap size
+    slots = max(MAX_ROADMAP_ITEMS - len(kept), 0)
+    wanted = []
+    for focus in needed:
+        count = min(REFRESH_TOPICS_PER_FOCUS.get(focus.partition(":")[0], 1), slots)
+        if count:
+            wanted.append((focus, count))
+            slots -= count
+    
+    added = []
+    if wanted:
+        topic_count = sum(count for _, count in wanted)
+        needed_lines = "\n".join(
+            f'    - {count} topic(s) with focus "{focus}": {describe_focus(focus, goal)}'
+            for focus, count in wanted
+        )
+        skills = ", ".join(f"{SKILL_FIELDS[field]} {score}/10" for field, score in snapshot["skills"].items())
+        prompt = f"""
+    Add {topic_count} topics to an existing placement preparation roadmap.
+    
+    USER: targets {', '.join(goal.target_companies)}; domain {goal.preferred_domain}; languages {', '.join(survey.programming_languages)}
+    SKILLS: {skills}
+    ALREADY IN THE ROADMAP (do not repeat): {'; '.join(item.topic for item in kept)}
+    
+    NEEDED:
+{needed_lines}
+    
+    Each topic needs: topic, description (1-2 sentences), priority (High/Medium/Low), estimated_hours, resources (2-3), focus (exactly as given above).
+    Return ONLY a JSON array of objects with these keys.
+    """
+        ai_response = await get_ai_response(prompt, ROADMAP_SYSTEM_MESSAGE)
+        
+        # Gemini doesn't always stick to the brief: keep only topics for the
+        # requested focuses, up to each one's count, that aren't already there.
+        # Parse the whole reply so stray topics can't push valid ones out.
+        remaining = dict(wanted)
+        seen_topics = {item.topic.strip().lower() for item in kept}
+        
+        def take(candidates: List[RoadmapItem]):
+            for item in candidates:
+                topic = item.topic.strip().lower()
+                if remaining.get(item.focus, 0) > 0 and topic not in seen_topics:
+                    added.append(item)
+                    remaining[item.focus] -= 1
+                    seen_topics.add(topic)
+        
+        take(parse_roadmap_items(ai_response, MAX_ROADMAP_ITEMS, snapshot))
+        if any(remaining.values()):
+            # Top up unfilled focuses with the fallback topics generate_roadmap would use
+            take(default_roadmap_items(goal, survey))
+    
+    roadmap_items = kept + added
+    roadmap_dict = await upsert_user_document(db.roadmaps, current_user.id, {
+        "roadmap_items": [item.dict() for item in roadmap_items],
+        "overall_progress": calculate_roadmap_progress(roadmap_items),
+        "profile_snapshot": snapshot,
+        "target_company": goal.target_companies[0] if goal.target_companies else "General",
+        "domain": goal.preferred_domain,
+        "updated_at": datetime.now(timezone.utc)
+    })
+    spawn_background(update_readiness_entry(current_user, {"roadmap_progress": roadmap_dict["overall_progress"]}))
+    if roadmap_dict.get("source", "ai") == "ai":
+        roadmap_reuse.add(current_user.id, snapshot)
     
-    # Recalculate overall progress
-    updated_roadmap = await db.roadmaps.find_one({"user_id": current_user.id})
-    total_items = len(updated_roadmap["roadmap_items"])
-    completed_items = sum(1 for item in updated_roadmap["roadmap_items"] if item["completed"])
-    progress = (completed_items / total_items * 100) if total_items > 0 else 0
+    return {
+        "roadmap": Roadmap(**roadmap_dict),
+        "removed_topics": [item.topic for item in removed],
+        "added_topics": [item.topic for item in added]
+    }
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_request_profiles():
+    """Kept request profiles, newest first"""
+    return {"profiles": [profile.summary() for profile in reversed(profile_store)]}
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(profile_id: str, fmt: str = Query("json", alias="format")):
+    """One profile as JSON, or its stack samples as a collapsed-stack file"""
+    profile = next((profile for profile in profile_store if profile.id == profile_id), None)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if fmt == "folded":
+        return Response(
+            content=profile.folded(),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile.id}.folded"'}
+        )
+    return profile.to_dict()
+
+@api_router.get("/admin/roadmap-reuse", dependencies=[Depends(require_admin)])
+async def get_roadmap_reuse_stats():
+    """Reuse hit rate plus how reused roadmaps fare against AI ones"""
+    by_source = await db.roadmaps.aggregate([
+        {"$group": {
+            "_id": {"$ifNull": ["$source", "ai"]},
+            "roadmaps": {"$sum": 1},
+            "average_progress": {"$avg": "$overall_progress"},
+            "started": {"$sum": {"$cond": [{"$gt": ["$overall_progress", 0]}, 1, 0]}}
+        }}
+    ]).to_list(None)
+    return {
+        "index": roadmap_reuse.report(),
+        "quality_by_source": {row["_id"]: {k: v for k, v in row.items() if k != "_id"} for row in by_source}
+    }
+
+@api_router.put("/roadmap/progress")
+async def update_progress(updates: dict, current_user: User = Depends(get_current_user)):
+    task_topic = updates.get("task_topic")
+    completed = updates.get("completed", False)
+    
+    now = datetime.now(timezone.utc)
     
-    await db.roadmaps.update_one(
+    # Update the specific task and recalculate overall progress in one pipeline update
+    total = {"$size": "$roadmap_items"}
+    done = {"$size": {"$filter": {"input": "$roadmap_items", "as": "item", "cond": "$$item.completed"}}}
+    updated_roadmap = await db.roadmaps.find_one_and_update(
         {"user_id": current_user.id},
-        {"$set": {"overall_progress": progress}}
+        [
+            {"$set": {
+                "roadmap_items": {"$map": {"input": "$roadmap_items", "as": "item", "in": {"$cond": [
+                    {"$eq": ["$$item.topic", {"$literal": task_topic}]},
+                    {"$mergeObjects": ["$$item", {
+                        "completed": {"$literal": completed},
+                        "completed_at": {"$literal": now if completed else None}
+                    }]},
+                    "$$item"
+                ]}}},
+                "updated_at": now
+            }},
+            {"$set": {"overall_progress": {"$cond": [
+                {"$gt": [total, 0]},
+                {"$multiply": [{"$divide": [done, total]}, 100]},
+                0
+            ]}}}
+        ],
+        projection={"_id": 0, "overall_progress": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_roadmap:
+        raise HTTPException(status_code=404, detail="Roadmap not found")
     
-    return {"progress": progress}
+    spawn_background(update_readiness_entry(current_user, {"roadmap_progress": updated_roadmap["overall_progress"]}))
+    return {"progress": updated_roadmap["overall_progress"]}
 
-@api_router.post("/test/start", response_model=MockTest)
+@api_router.post("/test/start", response_model=MockTestSession)
 async def start_mock_test(test_data: dict, current_user: User = Depends(get_current_user)):
     test_type = test_data.get("test_type", "DSA")
+    if test_data.get("adaptive"):
+        return await start_adaptive_test(current_user, test_type)
     
     # Generate sample questions (in real app would be from question bank)
     sample_questions = [
@@ -675,26 +2732,48 @@ async def start_mock_test(test_data: dict, current_user: User = Depends(get_curr
         )
     ]
     
-    mock_test = MockTest(
-        user_id=current_user.id,
-        test_type=test_type,
-        questions=sample_questions,
-        total_questions=len(sample_questions)
-    )
+    session = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "test_type": test_type,
+        "questions": [question.dict() for question in sample_questions],
+        "total_questions": len(sample_questions),
+        "started_at": datetime.now(timezone.utc),
+    }
     
-    await db.mock_tests.insert_one(mock_test.dict())
-    return mock_test
+    # Nothing is written to mock_tests until the test is submitted
+    await test_sessions.start(session)
+    return public_test_session(session)
 
-@api_router.put("/test/submit")
+@api_router.put("/test/submit", dependencies=[Depends(rate_limit_by_user("test_submit"))])
 async def submit_test(submission: dict, current_user: User = Depends(get_current_user)):
     test_id = submission.get("test_id")
     answers = submission.get("answers", {})
-    time_spent = submission.get("time_spent", 0)
     
-    # Get test
-    test_dict = await db.mock_tests.find_one({"id": test_id, "user_id": current_user.id})
+    # An adaptive test with nothing answered has no ability estimate to score;
+    # checked before claiming so the test can still be continued
+    session = await test_sessions.get(test_id, current_user.id)
+    if session and session.get("adaptive") and all(question["correct"] is None for question in session["questions"]):
+        raise HTTPException(status_code=400, detail="Answer at least one question before submitting")
+    
+    # Claiming the session removes it, so a second submit of the same test fails
+    test_dict = await test_sessions.claim(test_id, current_user.id)
     if not test_dict:
-        raise HTTPException(status_code=404, detail="Test not found")
+        if await db.mock_tests.count_documents({"id": test_id, "user_id": current_user.id}, limit=1):
+            raise HTTPException(status_code=409, detail="Test already submitted")
+        raise HTTPException(status_code=404, detail="Test not found or expired")
+    
+    if test_dict.get("adaptive"):
+        # Answers were graded one at a time; a question left open doesn't count
+        test_dict["questions"] = [question for question in test_dict["questions"] if question["correct"] is not None]
+        answers = {question["question_id"]: question["user_answer"] for question in test_dict["questions"]}
+    
+    # Timed on the server from when the test was started
+    started_at = test_dict["started_at"]
+    if started_at.tzinfo is None:  # read back from MongoDB
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    completed_at = datetime.now(timezone.utc)
+    time_spent = int((completed_at - started_at).total_seconds())
     
     # Calculate score
     correct_count = 0
@@ -703,16 +2782,22 @@ async def submit_test(submission: dict, current_user: User = Depends(get_current
     
     for question in test_dict["questions"]:
         user_answer = answers.get(question["question_id"], "")
+        question["user_answer"] = user_answer
         if user_answer == question["correct_answer"]:
             correct_count += 1
         else:
             # Add to weak areas (simplified)
-            if "complexity" in question["question"].lower():
+            if question.get("topic"):
+                weak_areas.append(question["topic"])
+            elif "complexity" in question["question"].lower():
                 weak_areas.append("Time Complexity")
             elif "data structure" in question["question"].lower():
                 weak_areas.append("Data Structures")
     
     score = (correct_count / total_questions * 100) if total_questions > 0 else 0
+    if test_dict.get("adaptive"):
+        # Everyone gets about half of an adaptive test right, so score the ability instead
+        score = ability_to_score(test_dict["ability"])
     
     # Generate AI feedback
     feedback_prompt = f"""
@@ -727,20 +2812,25 @@ async def submit_test(submission: dict, current_user: User = Depends(get_current
     
     feedback = await get_ai_response(feedback_prompt, "You are a coding interview coach providing actionable feedback.")
     
-    # Update test results
-    await db.mock_tests.update_one(
-        {"id": test_id},
-        {
-            "$set": {
-                "score": score,
-                "correct_answers": correct_count,
-                "time_spent": time_spent,
-                "weak_areas": list(set(weak_areas)),
-                "feedback": feedback,
-                "completed_at": datetime.now(timezone.utc)
-            }
-        }
+    # The completed test is the only write a mock test costs
+    mock_test = MockTest(
+        id=test_id,
+        user_id=current_user.id,
+        test_type=test_dict["test_type"],
+        questions=test_dict["questions"],
+        score=score,
+        total_questions=total_questions,
+        correct_answers=correct_count,
+        time_spent=time_spent,
+        weak_areas=list(set(weak_areas)),
+        feedback=feedback,
+        adaptive=test_dict.get("adaptive", False),
+        ability=test_dict.get("ability"),
+        completed_at=completed_at
     )
+    await db.mock_tests.insert_one(mock_test.dict())
+    
+    spawn_background(update_readiness_entry(current_user, test_type=mock_test.test_type, test_score=score))
     
     return {
         "score": score,
@@ -750,17 +2840,57 @@ async def submit_test(submission: dict, current_user: User = Depends(get_current
         "weak_areas": weak_areas
     }
 
+@api_router.put("/test/answer")
+async def answer_adaptive_question(answer: dict, current_user: User = Depends(get_current_user)):
+    """Grade the open question of an adaptive test and pick the next one"""
+    session = await test_sessions.get(answer.get("test_id"), current_user.id)
+    if not session or not session.get("adaptive"):
+        raise HTTPException(status_code=404, detail="Adaptive test not found or expired")
+    
+    question = session["questions"][-1]
+    if question["question_id"] != answer.get("question_id") or question["correct"] is not None:
+        raise HTTPException(status_code=409, detail="That question is not the open one")
+    question["user_answer"] = answer.get("answer", "")
+    question["correct"] = question["user_answer"] == question["correct_answer"]
+    
+    bank = item_banks[session["test_type"]]
+    asked = [asked_question["item"] for asked_question in session["questions"]]
+    ability, error = bank.estimate(asked, [asked_question["correct"] for asked_question in session["questions"]])
+    session["ability"], session["standard_error"] = ability, error
+    
+    next_item = None
+    if len(asked) < session["total_questions"] and error > ADAPTIVE_TARGET_ERROR:
+        next_item = bank.select(ability, asked)
+    if next_item is not None:
+        session["questions"].append(bank.question(next_item))
+    await test_sessions.save(session, ["questions", "ability", "standard_error"])
+    
+    return {
+        "answered": len(asked),
+        "ability": ability,
+        "standard_error": error,
+        "finished": next_item is None,  # submit the test once finished
+        "next_question": PublicTestQuestion(**session["questions"][-1]) if next_item is not None else None
+    }
+
 @api_router.get("/tests/history", response_model=List[MockTest])
 async def get_test_history(current_user: User = Depends(get_current_user)):
     tests = await db.mock_tests.find({"user_id": current_user.id}).to_list(1000)
     return [MockTest(**test) for test in tests]
 
-@api_router.get("/progress", response_model=ProgressTracker)
-async def get_progress(current_user: User = Depends(get_current_user)):
+async def fetch_stored_progress(user_id: str) -> Optional[dict]:
+    return await db.progress.find_one({"user_id": user_id}, {"_id": 0})
+
+async def fetch_progress_tests(user_id: str) -> List[dict]:
+    # Readiness only needs scores, so don't pull every question back
+    return await db.mock_tests.find(
+        {"user_id": user_id},
+        {"_id": 0, "score": 1, "completed_at": 1}
+    ).to_list(1000)
+
+async def calculate_progress(user_id: str, roadmap_dict: Optional[dict], tests: List[dict], stored: Optional[dict]) -> ProgressTracker:
+    """Progress computed on read; `stored` is the user's saved progress document, if any"""
     # Calculate readiness based on roadmap completion and test scores
-    roadmap_dict = await db.roadmaps.find_one({"user_id": current_user.id})
-    tests = await db.mock_tests.find({"user_id": current_user.id}).to_list(1000)
-    
     readiness = 0
     category_progress = {}
     
@@ -780,19 +2910,144 @@ async def get_progress(current_user: User = Depends(get_current_user)):
             category_progress["tests"] = avg_score
     
     progress = ProgressTracker(
-        user_id=current_user.id,
+        user_id=user_id,
         readiness_percentage=min(readiness, 100),
         category_progress=category_progress
     )
     
-    # Store/update progress
-    await db.progress.update_one(
-        {"user_id": current_user.id},
-        {"$set": progress.dict()},
-        upsert=True
+    # Only write when something changed, so reading progress stays a read
+    if stored and stored.get("readiness_percentage") == progress.readiness_percentage \
+            and stored.get("category_progress") == progress.category_progress:
+        return ProgressTracker(**stored)
+    progress_dict = await upsert_user_document(db.progress, user_id, progress.dict(exclude={"id"}), on_insert={"id": progress.id})
+    return ProgressTracker(**progress_dict)
+
+@api_router.get("/export/tests", dependencies=[Depends(require_admin)])
+async def export_tests(
+    fmt: str = Query("ndjson", alias="format"),
+    compress: bool = Query(False, alias="gzip"),
+    test_type: Optional[str] = None,
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None
+):
+    """Stream mock test results for placement cells (admin only)"""
+    query: Dict[str, Any] = {}
+    if test_type:
+        query["test_type"] = test_type
+    if user_id:
+        query["user_id"] = user_id
+    if since:
+        query["completed_at"] = {"$gte": since}
+    
+    projection = {column: 1 for column in TEST_EXPORT_COLUMNS} if fmt == "csv" else None
+    cursor = db.mock_tests.find(query, projection, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1)
+    return export_response(cursor, "mock-tests", fmt, TEST_EXPORT_COLUMNS, compress)
+
+@api_router.get("/progress", response_model=ProgressTracker)
+async def get_progress(current_user: User = Depends(get_current_user)):
+    roadmap_dict, tests, stored = await asyncio.gather(
+        db.roadmaps.find_one({"user_id": current_user.id}),
+        fetch_progress_tests(current_user.id),
+        fetch_stored_progress(current_user.id)
     )
+    return await calculate_progress(current_user.id, roadmap_dict, tests, stored)
+
+DASHBOARD_SECTIONS = ("profile", "goals", "survey", "roadmap", "progress")
+
+@api_router.get("/dashboard")
+async def get_dashboard(fields: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Profile, goals, survey, roadmap and progress in a single request.
+
+    Pass `fields=goals,roadmap` to fetch only the sections you render. All
+    sections are loaded concurrently and the roadmap is read at most once.
+    """
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in DASHBOARD_SECTIONS]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown dashboard fields: {', '.join(unknown)}. Allowed: {', '.join(DASHBOARD_SECTIONS)}"
+            )
+    else:
+        requested = list(DASHBOARD_SECTIONS)
     
-    return progress
+    # Shared by the roadmap and progress sections
+    roadmap_read = None
+    if "roadmap" in requested or "progress" in requested:
+        roadmap_read = asyncio.ensure_future(db.roadmaps.find_one({"user_id": current_user.id}))
+    
+    async def load_profile():
+        return current_user
+    
+    async def load_goals():
+        goal_dict = await db.goals.find_one({"user_id": current_user.id})
+        return Goal(**goal_dict) if goal_dict else None
+    
+    async def load_survey():
+        survey_dict = await db.surveys.find_one({"user_id": current_user.id})
+        return SurveyResponse(**survey_dict) if survey_dict else None
+    
+    async def load_roadmap():
+        roadmap_dict = await roadmap_read
+        return Roadmap(**roadmap_dict) if roadmap_dict else None
+    
+    async def load_progress():
+        roadmap_dict, tests, stored = await asyncio.gather(
+            roadmap_read, fetch_progress_tests(current_user.id), fetch_stored_progress(current_user.id)
+        )
+        return await calculate_progress(current_user.id, roadmap_dict, tests, stored)
+    
+    loaders = {
+        "profile": load_profile,
+        "goals": load_goals,
+        "survey": load_survey,
+        "roadmap": load_roadmap,
+        "progress": load_progress,
+    }
+    results = await asyncio.gather(*(loaders[name]() for name in requested))
+    return dict(zip(requested, results))
+
+@api_router.get("/leaderboard/{company}")
+async def get_leaderboard(company: str, limit: int = 10, current_user: User = Depends(get_current_user)):
+    """Top users by readiness among everyone targeting `company`"""
+    limit = max(1, min(limit, 100))
+    top, own = await asyncio.gather(
+        db.readiness_board.find(
+            {"companies": company},
+            {"_id": 0, "user_id": 1, "user_name": 1, "college": 1, "readiness": 1}
+        ).sort("readiness", -1).limit(limit).to_list(limit),
+        db.readiness_board.find_one(
+            {"user_id": current_user.id},
+            {"_id": 0, "readiness": 1, "companies": 1}
+        )
+    )
+    return {
+        "company": company,
+        "leaders": [
+            {"rank": rank, "user_name": entry["user_name"], "college": entry.get("college", ""),
+             "readiness": entry["readiness"], "is_you": entry["user_id"] == current_user.id}
+            for rank, entry in enumerate(top, start=1)
+        ],
+        "your_readiness": own["readiness"] if own and company in own.get("companies", []) else None
+    }
+
+@api_router.get("/cohorts/all")
+async def get_overall_cohort(current_user: User = Depends(get_current_user)):
+    stats = await db.cohort_stats.find_one({"_id": "all"})
+    if not stats:
+        raise HTTPException(status_code=404, detail="No cohort data yet")
+    return format_cohort_stats(stats)
+
+@api_router.get("/cohorts/{dimension}/{value}")
+async def get_cohort(dimension: str, value: str, current_user: User = Depends(get_current_user)):
+    """Readiness and test score distributions for a company or college cohort"""
+    if dimension not in ("company", "college"):
+        raise HTTPException(status_code=400, detail="Cohort dimension must be 'company' or 'college'")
+    stats = await db.cohort_stats.find_one({"_id": f"{dimension}:{value}"})
+    if not stats:
+        raise HTTPException(status_code=404, detail="No cohort data yet")
+    return format_cohort_stats(stats)
 
 @api_router.get("/companies")
 async def get_companies():
@@ -807,26 +3062,61 @@ async def get_languages():
     return {"languages": PROGRAMMING_LANGUAGES}
 
 @api_router.get("/chatrooms/{company}/messages")
-async def get_chat_history(company: str, limit: int = 100):
-    messages = await db.chat_messages.find({"company": company}).sort("timestamp", -1).limit(limit).to_list(limit)
+async def get_chat_history(company: str, limit: int = 100, before: Optional[datetime] = None):
+    """The `limit` messages before `before` (default: the latest), oldest first.
+
+    The latest page comes from the hot collection only; pass `before` to page
+    back into archived messages.
+    """
+    query: Dict[str, Any] = {"company": company}
+    if before:
+        query["timestamp"] = {"$lt": before}
+    messages = await db.chat_messages.find(query).sort("timestamp", -1).limit(limit).to_list(limit)
+    
+    # Paging back past the hot collection continues in the archive; polling
+    # for the latest page never touches the disk
+    if before and len(messages) < limit and await chat_archive.has_room(company):
+        oldest = messages[-1]["timestamp"] if messages else before
+        messages += await asyncio.to_thread(chat_archive.older_messages, company, oldest, limit - len(messages))
     return [ChatMessage(**msg) for msg in reversed(messages)]
 
+@api_router.get("/export/chat", dependencies=[Depends(require_admin)])
+async def export_chat(
+    fmt: str = Query("ndjson", alias="format"),
+    compress: bool = Query(False, alias="gzip"),
+    company: Optional[str] = None,
+    since: Optional[datetime] = None
+):
+    """Stream chat transcripts, optionally for one company room (admin only).
+
+    Only messages still in chat_messages; archived ones are in CHAT_ARCHIVE_DIR.
+    """
+    query: Dict[str, Any] = {}
+    if company:
+        query["company"] = company
+    if since:
+        query["timestamp"] = {"$gte": since}
+    
+    cursor = db.chat_messages.find(query, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1)
+    return export_response(cursor, "chat-messages", fmt, CHAT_EXPORT_COLUMNS, compress)
+
 class ChatMessageRequest(BaseModel):
     company: str
     message: str
-    user_id: str
-    user_name: str
+    # Still sent by older clients; the sender is always the authenticated user
+    user_id: Optional[str] = None
+    user_name: Optional[str] = None
 
-@api_router.post("/chat/send", response_model=ChatMessage)
+@api_router.post("/chat/send", response_model=ChatMessage, dependencies=[Depends(rate_limit_by_user("send_message"))])
 async def send_chat_message(
     request: ChatMessageRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: User = Depends(get_current_user)
 ):
     """Send a message to a company chat room"""
     chat_message = ChatMessage(
         id=str(uuid.uuid4()),
-        user_id=request.user_id,
-        user_name=request.user_name,
+        user_id=current_user.id,
+        user_name=current_user.name,
         company=request.company,
         message=request.message,
         timestamp=datetime.now(timezone.utc)
@@ -839,13 +3129,228 @@ async def send_chat_message(
 
 # ===== SOCKET.IO EVENTS =====
 
+class RoomPresence:
+    """Who is in each company room, with join/leave notifications batched.
+
+    Members are keyed by user id (or sid for anonymous clients) and map to the
+    set of their sids, so several tabs count once and the member count is a
+    len(). Instead of a broadcast per transition, each room gets at most one
+    `presence_diff` per flush interval listing net joins and leaves; someone
+    who joins and leaves within the interval produces nothing.
+    """
+
+    def __init__(self, flush_interval: float, max_diff_entries: int):
+        self.flush_interval = flush_interval
+        self.max_diff_entries = max_diff_entries
+        self.rooms: Dict[str, Dict[str, set]] = {}
+        self.names: Dict[str, str] = {}
+        self.memberships: Dict[str, int] = {}  # member key -> rooms joined across all sids
+        self.sid_rooms: Dict[str, Dict[str, str]] = {}  # sid -> {company: member key}
+        self.pending: Dict[str, Dict[str, bool]] = {}  # company -> {member key: present at last flush}
+
+    def count(self, company: str) -> int:
+        return len(self.rooms.get(company, ()))
+
+    def members(self, company: str, limit: int = 100) -> List[dict]:
+        members = []
+        for key in self.rooms.get(company, ()):
+            if len(members) >= limit:
+                break
+            members.append({"user_id": key, "user_name": self.names.get(key, "Anonymous")})
+        return members
+
+    def _touch(self, company: str, key: str):
+        room_pending = self.pending.setdefault(company, {})
+        if key not in room_pending:
+            room_pending[key] = key in self.rooms.get(company, ())
+
+    def join(self, sid: str, company: str, user_id: Optional[str], user_name: str):
+        key = user_id or sid
+        current = self.sid_rooms.get(sid, {}).get(company)
+        if current == key:
+            return
+        if current is not None:
+            # Re-joining under another user id replaces the old membership
+            self.leave(sid, company)
+        self._touch(company, key)
+        self.names[key] = user_name
+        self.memberships[key] = self.memberships.get(key, 0) + 1
+        self.rooms.setdefault(company, {}).setdefault(key, set()).add(sid)
+        self.sid_rooms.setdefault(sid, {})[company] = key
+
+    def leave(self, sid: str, company: str):
+        key = self.sid_rooms.get(sid, {}).pop(company, None)
+        if key is None:
+            return
+        if not self.sid_rooms[sid]:
+            del self.sid_rooms[sid]
+        self._touch(company, key)
+        self.memberships[key] -= 1
+        room = self.rooms[company]
+        room[key].discard(sid)
+        if not room[key]:
+            del room[key]
+            if not room:
+                del self.rooms[company]
+
+    def disconnect(self, sid: str):
+        for company in list(self.sid_rooms.get(sid, {})):
+            self.leave(sid, company)
+
+    def take_diffs(self) -> List[dict]:
+        diffs = []
+        pending, self.pending = self.pending, {}
+        for company, changes in pending.items():
+            room = self.rooms.get(company, {})
+            joined, left = [], []
+            for key, was_present in changes.items():
+                present = key in room
+                if present and not was_present:
+                    joined.append({"user_id": key, "user_name": self.names.get(key, "Anonymous")})
+                elif was_present and not present:
+                    left.append({"user_id": key, "user_name": self.names.get(key, "Anonymous")})
+            if joined or left:
+                diffs.append({
+                    "company": company,
+                    "count": len(room),
+                    "joined": joined[:self.max_diff_entries],
+                    "left": left[:self.max_diff_entries],
+                    "truncated": len(joined) > self.max_diff_entries or len(left) > self.max_diff_entries
+                })
+            # Names are kept until the leave has been announced
+            for key in changes:
+                if not self.memberships.get(key):
+                    self.memberships.pop(key, None)
+                    self.names.pop(key, None)
+        return diffs
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for diff in self.take_diffs():
+                try:
+                    await sio.emit('presence_diff', diff, room=diff["company"])
+                except Exception as e:
+                    socket_logger.error("Presence broadcast failed for %s: %s", diff['company'], e)
+
+presence = RoomPresence(
+    flush_interval=float(os.environ.get("PRESENCE_FLUSH_SECONDS", "1.0")),
+    max_diff_entries=int(os.environ.get("PRESENCE_MAX_DIFF_ENTRIES", "50"))
+)
+
+class RoomBroadcaster:
+    """Delivers chat messages to rooms, optionally batched, with backpressure.
+
+    With a batch interval, messages for a room are collected and sent as one
+    `new_messages` event per interval instead of one `new_message` each, which
+    turns N messages x M members writes into (intervals x M). Independently,
+    any connection whose outbound queue holds more than `max_queue` packets
+    is skipped (policy "drop") or disconnected (policy "disconnect") so a slow
+    polling client can't grow its queue without bound. The queues report
+    themselves as they back up and drain (see OutboundQueue), so a broadcast
+    only looks at the connections that are currently behind.
+    """
+
+    def __init__(self, batch_interval: float, max_queue: int, slow_policy: str):
+        self.batch_interval = batch_interval
+        self.max_queue = max_queue
+        self.slow_policy = slow_policy
+        self.pending: Dict[str, List[dict]] = {}
+        self.congested: "weakref.WeakSet[OutboundQueue]" = weakref.WeakSet()
+        self.stats = {"messages": 0, "emits": 0, "dropped": 0, "disconnected": 0}
+
+    def _slow_sids(self) -> List[str]:
+        slow = []
+        for queue in list(self.congested):
+            if queue.eio_sid is None:
+                # Found once per backed-up queue; the socket is long registered by then
+                queue.eio_sid = next((eio_sid for eio_sid, socket in sio.eio.sockets.items() if socket.queue is queue), None)
+            sid = sio.manager.sid_from_eio_sid(queue.eio_sid, '/') if queue.eio_sid else None
+            if sid:
+                slow.append(sid)
+            else:
+                self.congested.discard(queue)  # the connection is gone
+        return slow
+
+    async def deliver(self, event: str, data: dict, room: str):
+        # Skipping sids that aren't in the room is a no-op, so no membership check
+        slow = self._slow_sids() if self.congested else []
+        if slow:
+            if self.slow_policy == "disconnect":
+                self.stats["disconnected"] += len(slow)
+                for sid in slow:
+                    await sio.disconnect(sid)
+            else:
+                self.stats["dropped"] += len(slow)
+        await sio.emit(event, data, room=room, skip_sid=slow or None)
+        self.stats["emits"] += 1
+
+    async def publish(self, room: str, message: dict):
+        self.stats["messages"] += 1
+        if self.batch_interval <= 0:
+            await self.deliver('new_message', message, room)
+        else:
+            self.pending.setdefault(room, []).append(message)
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for room, messages in pending.items():
+            try:
+                await self.deliver('new_messages', {'company': room, 'messages': messages}, room)
+            except Exception as e:
+                socket_logger.error("Broadcast to %s failed: %s", room, e)
+
+    async def run(self):
+        if self.batch_interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            await self.flush()
+
+broadcaster = RoomBroadcaster(
+    batch_interval=float(os.environ.get("BROADCAST_BATCH_MS", "0")) / 1000,
+    max_queue=int(os.environ.get("MAX_OUTBOUND_QUEUE", "200")),
+    slow_policy=os.environ.get("SLOW_CONSUMER_POLICY", "drop").lower()
+)
+on_shutdown(broadcaster.flush)
+
+class OutboundQueue(asyncio.Queue):
+    """An engine.io socket's packet queue that tells the broadcaster when it
+    grows past MAX_OUTBOUND_QUEUE and when it drains back below it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.eio_sid: Optional[str] = None
+
+    def _put(self, item):
+        super()._put(item)
+        if broadcaster.max_queue and self.qsize() > broadcaster.max_queue:
+            broadcaster.congested.add(self)
+
+    def _get(self):
+        item = super()._get()
+        if self.qsize() <= broadcaster.max_queue:
+            broadcaster.congested.discard(self)
+        return item
+
+# engine.io creates each socket's queue through this hook
+sio.eio.create_queue = OutboundQueue
+
+@api_router.get("/chatrooms/{company}/presence")
+async def get_room_presence(company: str, limit: int = 100):
+    return {"company": company, "count": presence.count(company), "members": presence.members(company, max(0, min(limit, 500)))}
+
 @sio.event
 async def connect(sid, environ):
-    print(f"Client {sid} connected")
+    forwarded = environ.get("HTTP_X_FORWARDED_FOR", "") if TRUST_FORWARDED_FOR else ""
+    ip = forwarded_client_ip(forwarded) or environ.get("REMOTE_ADDR", "unknown")
+    await sio.save_session(sid, {"ip": ip})
+    socket_logger.info("Client %s connected", sid)
 
 @sio.event
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
+    presence.disconnect(sid)
+    socket_logger.info("Client %s disconnected", sid)
 
 @sio.event
 async def join_room(sid, data):
@@ -854,21 +3359,21 @@ async def join_room(sid, data):
     user_name = data.get("user_name", "Anonymous")
     
     await sio.enter_room(sid, company)
-    await sio.emit('user_joined', {
-        'user_name': user_name,
-        'message': f'{user_name} joined the {company} room'
-    }, room=company)
+    presence.join(sid, company, user_id, user_name)
+    
+    # The room hears about this join in the next batched presence_diff
+    await sio.emit('presence_snapshot', {
+        'company': company,
+        'count': presence.count(company),
+        'members': presence.members(company)
+    }, to=sid)
 
 @sio.event
 async def leave_room(sid, data):
     company = data.get("company")
-    user_name = data.get("user_name", "Anonymous")
     
     await sio.leave_room(sid, company)
-    await sio.emit('user_left', {
-        'user_name': user_name,
-        'message': f'{user_name} left the {company} room'
-    }, room=company)
+    presence.leave(sid, company)
 
 @sio.event
 async def send_message(sid, data):
@@ -877,6 +3382,16 @@ async def send_message(sid, data):
     user_id = data.get("user_id")
     user_name = data.get("user_name", "Anonymous")
     
+    # user_id comes from the client unchecked, so limit by the connection's IP
+    session = await sio.get_session(sid)
+    retry_after = await rate_limiter.hit("send_message", session.get("ip", sid))
+    if retry_after:
+        await sio.emit('rate_limited', {
+            'event': 'send_message',
+            'retry_after': max(1, math.ceil(retry_after))
+        }, to=sid)
+        return
+    
     # Store message in database
     message = ChatMessage(
         user_id=user_id,
@@ -887,14 +3402,22 @@ async def send_message(sid, data):
     
     await db.chat_messages.insert_one(message.dict())
     
-    # Broadcast to room
-    await sio.emit('new_message', {
+    # Broadcast to room (batched into new_messages when BROADCAST_BATCH_MS is set)
+    await broadcaster.publish(company, {
         'id': message.id,
         'user_name': user_name,
         'message': message_text,
         'timestamp': message.timestamp.isoformat(),
         'company': company
-    }, room=company)
+    })
+
+if COUNT_DB_ROUND_TRIPS:
+    @main_app.middleware("http")
+    async def count_db_round_trips(request: Request, call_next):
+        before = db_command_counter.count
+        response = await call_next(request)
+        response.headers["X-DB-Round-Trips"] = str(db_command_counter.count - before)
+        return response
 
 # IMPORTANT: Define all API endpoints BEFORE mounting static files
 # Health check endpoint - must be before static files mount
@@ -918,28 +3441,39 @@ main_app.include_router(api_router)
 
 # AFTER including API routes, mount the frontend as fallback
 frontend_build_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "frontend", "build"))
-print(f"Final check - Frontend build path: {frontend_build_path}")
+logger.info("Final check - Frontend build path: %s", frontend_build_path)
 if os.path.exists(frontend_build_path) and os.path.exists(os.path.join(frontend_build_path, "index.html")):
-    print("Mounting frontend React app as fallback")
+    logger.info("Mounting frontend React app as fallback")
     main_app.mount("/", StaticFiles(directory=frontend_build_path, html=True), name="frontend")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup code here
     logger.info("Starting CrackIt.AI server...")
-    logger.info(f"Socket.IO server configured with transports: {sio.transport}")
+    await rate_limiter.backend.setup()
+    await ensure_user_document_indexes()
+    await ensure_leaderboard_indexes()
+    spawn_background(backfill_readiness_board(), name="backfill_readiness_board")
+    await skill_snapshot.ensure_indexes()
+    await test_sessions.ensure_indexes()
+    await chat_archive.ensure_indexes()
+    spawn_background(roadmap_reuse.build(), name="build_roadmap_reuse_index")
+    skill_refresher = asyncio.create_task(refresh_skill_snapshot_periodically())
+    presence_flusher = asyncio.create_task(presence.run())
+    broadcast_flusher = asyncio.create_task(broadcaster.run())
+    chat_archiver = asyncio.create_task(chat_archive.run(CHAT_ARCHIVE_INTERVAL_SECONDS)) if chat_archive.enabled else None
+    logger.info("Socket.IO server configured with transports: %s", sio.transport)
     yield
-    # Shutdown code here
+    # Shutdown code here - uvicorn has already stopped accepting and drained in-flight requests
     logger.info("Shutting down CrackIt.AI server...")
+    skill_refresher.cancel()
+    presence_flusher.cancel()
+    broadcast_flusher.cancel()
+    if chat_archiver:
+        chat_archiver.cancel()
+    await drain_background_work(float(os.environ.get("DRAIN_TIMEOUT", "20")))
     client.close()
 
 # Update the main_app with lifespan instead of creating a new one
@@ -1032,9 +3566,55 @@ app = socket_app
 # Use: uvicorn server:main_app --reload
 # For production with Socket.IO: use server:app or server:socket_app
 
+def run_production():
+    """Serve socket_app (API + Socket.IO) with production settings.
+
+    Uses uvloop and httptools when installed, one worker unless
+    WEB_CONCURRENCY is set, and drains on SIGTERM: uvicorn stops accepting,
+    waits up to GRACEFUL_TIMEOUT for in-flight requests, then the lifespan
+    shutdown waits for background jobs and flushes buffered writes.
+
+    One worker is the default because a lot of state is per process: started
+    mock tests (unless TEST_SESSION_WRITE_AHEAD), Socket.IO rooms and
+    presence, and the in-memory rate limiter. More workers also need sticky
+    sessions for Socket.IO long-polling.
+    """
+    import importlib.util
+
+    workers = int(os.environ.get("WEB_CONCURRENCY") or 1)
+    if workers > 1:
+        logger.warning(
+            "Running %d workers: Socket.IO broadcasts and presence only reach clients of the same worker%s%s",
+            workers,
+            "" if test_sessions.write_ahead else ", mock tests must be submitted to the worker that started them",
+            "" if isinstance(rate_limiter.backend, MongoRateLimitBackend) else ", rate limits are per worker",
+        )
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info("Starting %d worker(s) with loop=%s http=%s", workers, loop, http)
+
+    uvicorn.run(
+        # Multiple workers have to import the app themselves
+        "server:socket_app" if workers > 1 else socket_app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=int(os.environ.get("BACKLOG", "2048")),
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_TIMEOUT", "5")),
+        timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_TIMEOUT", "30")),
+        proxy_headers=True,
+        # Only these peers may set the client address uvicorn reports
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        access_log=os.environ.get("ACCESS_LOG", "true").lower() == "true",
+        log_config=None,  # keep the queue-based logging set up at import
+    )
+
 # Make sure both apps are available for different deployment scenarios
+# Production: python server.py (see run_production for the tunables)
 if __name__ == "__main__":
-    uvicorn.run(main_app, host="0.0.0.0", port=8000, reload=False)
+    run_production()
 
 # Render.com deployment - Direct ASGI app export
 application = socket_app
\ No newline at end of file
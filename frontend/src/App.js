@@ -1930,7 +1930,7 @@ const MockTests = () => {
 
     setLoading(true);
     try {
-      const testStartTime = new Date(currentTest.completed_at).getTime();
+      const testStartTime = new Date(currentTest.started_at).getTime();
       const timeSpent = Math.floor((Date.now() - testStartTime) / 1000);
 
       const response = await axios.put(`${API}/test/submit`, {